@@ -1,46 +1,319 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, redirect, g
 from flask_cors import CORS
 import os
 import uuid
 import base64
+import hashlib
 from dotenv import load_dotenv
 import replicate
-from werkzeug.utils import secure_filename
 import io
 import json
 import requests
+import httpx
 import random
+import time
 import logging
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
 from resultsViz import main as analyze_results  # Re-enabled ML analysis
-from openai import OpenAI  # Updated import for v1.0+
+from fastScore import main as fast_analyze_results
+from leaderboard import Leaderboard
+from vector_index import VectorIndex
+from generation_scheduler import GenerationScheduler, GenerationQueueFull
+from single_flight import SingleFlight
+from game_versions import GameVersions
+from game_archive import GameArchive
+from image_storage import create_image_store
+from upload_stream import StreamingRequest, inspect_image
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from deadline import Deadline, DeadlineExceeded
+from structured_logging import setup_logging, init_request_context, log_stage
+from profiling import SamplingProfiler, check_profiling_token, collapse_stacks, init_request_profiling, render_flame_graph
+from openai import OpenAI, APITimeoutError  # Updated import for v1.0+
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+app.request_class = StreamingRequest
 CORS(app)
 
+# JSON lines written from a background thread; DEBUG lines are sampled (LOG_DEBUG_SAMPLE_RATE)
+setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    sample_rates={logging.DEBUG: float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.1))}
+)
+init_request_context(app)
+logger = logging.getLogger('app')
+
 # Configuration
-UPLOAD_FOLDER = 'uploads'
-IMAGES_FOLDER = 'images'
+# Each shard worker (see shard_dispatcher.py) gets its own data folders
+STORE_FOLDER = os.getenv('STORE_FOLDER', 'store')
+INDEX_FOLDER = os.getenv('INDEX_FOLDER', 'index')
+ARCHIVE_FOLDER = os.getenv('ARCHIVE_FOLDER', 'archive')
+# Set by shard_dispatcher for its workers, enables the /api/internal routes
+SHARD_WORKER = os.getenv('SHARD_WORKER') == '1'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+# Uploads larger than this are rejected with a 413 while they are still streaming in
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 10 * 1024 * 1024))
+# except game transfers from the dispatcher, which carry every image of a game base64-encoded
+# (workers only listen on 127.0.0.1 and the dispatcher never proxies /api/internal)
+app.config['UNLIMITED_INTERNAL_BODIES'] = SHARD_WORKER
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 25_000_000))
+ANALYSIS_MODES = {'accurate', 'fast'}
+
+# Outbound flux-kontext-pro calls: concurrency cap and how many turns may wait for a slot
+GENERATION_CONCURRENCY = int(os.getenv('GENERATION_CONCURRENCY', 4))
+GENERATION_QUEUE_SIZE = int(os.getenv('GENERATION_QUEUE_SIZE', 32))
+
+# End-to-end time budget per request (clients may ask for less with X-Request-Timeout)
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', 120))
+# Upper bounds for single upstream calls, further capped by the request's remaining budget
+OPENAI_TIMEOUT_SECONDS = 15
+REPLICATE_HTTP_TIMEOUT_SECONDS = 30
+DOWNLOAD_TIMEOUT_SECONDS = 30
+# A finished generation is paid for, so its download always gets at least this long
+MIN_DOWNLOAD_TIMEOUT_SECONDS = 10
+# Don't start a (paid) generation with less budget left than this, it would only be cancelled
+MIN_GENERATION_BUDGET_SECONDS = 20
+# Also archive the MiniLM/ViT embeddings of each analyzed game (about 3 KB per image)
+ARCHIVE_EMBEDDINGS = os.getenv('ARCHIVE_EMBEDDINGS', 'False') == 'True'
+
+# Longest a /status long-poll (?waitForVersion=) is held open
+MAX_STATUS_WAIT_SECONDS = 60
+
+# Profiling endpoints and X-Profile are disabled unless a token is set
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')
+MAX_PROFILE_SECONDS = 60
+
+# Similarity above which a match is reported as a duplicate upload / reused prompt
+DUPLICATE_IMAGE_THRESHOLD = 0.98
+REUSED_PROMPT_THRESHOLD = 0.95
+
 # Ensure directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(IMAGES_FOLDER, exist_ok=True)
+os.makedirs(STORE_FOLDER, exist_ok=True)
+os.makedirs(INDEX_FOLDER, exist_ok=True)
 
 # Game state storage (in production, use a proper database)
 games = {}
 
+# Uploaded and generated images, content-addressed - game['images'] holds their hashes
+image_store = create_image_store(STORE_FOLDER)
+# Uploads stream straight into the store's temp dir so they can be adopted with a rename
+app.config['UPLOAD_TEMP_DIR'] = image_store.temp_dir
+
+# Final scores of every analyzed game, ranked across all games (journaled next to the vector index)
+LEADERBOARD_PATH = os.path.join(INDEX_FOLDER, 'leaderboard.jsonl')
+first_leaderboard_start = not os.path.exists(LEADERBOARD_PATH)
+leaderboard = Leaderboard(path=LEADERBOARD_PATH)
+
+# MiniLM prompt embeddings (384-d) and ViT CLS image embeddings (768-d) of analyzed games
+prompt_vectors = VectorIndex(os.path.join(INDEX_FOLDER, 'prompts'), 384)
+image_vectors = VectorIndex(os.path.join(INDEX_FOLDER, 'images'), 768)
+
+generation_scheduler = GenerationScheduler(GENERATION_CONCURRENCY, GENERATION_QUEUE_SIZE)
+
+def caused_by_request_budget(error):
+    """
+    True for failures that come from a budget the client shortened with
+    X-Request-Timeout rather than from the upstream: a blown deadline or a
+    timeout. Breakers don't count these, so short client budgets can't open
+    them. With the default budget a deadline or timeout means the upstream
+    hung, and that is recorded like any other failure.
+    """
+    timeout_errors = (DeadlineExceeded, httpx.TimeoutException, APITimeoutError, requests.Timeout)
+    return isinstance(error, timeout_errors) and g.deadline.shortened
+
+# Open on error rate or on calls slower than slow_call_seconds, then fail fast until they recover
+openai_breaker = CircuitBreaker('openai', slow_call_seconds=10, open_seconds=30, neutral=caused_by_request_budget)
+replicate_breaker = CircuitBreaker('replicate', slow_call_seconds=90, open_seconds=60, neutral=caused_by_request_budget)
+
+# In-flight /analyze computations, keyed by game and analysis fingerprint
+analysis_flight = SingleFlight()
+
+# Append-only columnar copy of every analysis, partitioned by day, for offline analytics
+game_archive = GameArchive(ARCHIVE_FOLDER, keep_embeddings=ARCHIVE_EMBEDDINGS)
+
+def backfill_leaderboard():
+    """
+    Seed a new leaderboard journal from the archive: the latest accurate score
+    of every archived game (fallback analyses are never archived).
+    """
+    columns = ['game_id', 'archived_at', 'final_score',
+               'mean_prompt_semantic', 'mean_prompt_levenshtein', 'mean_image_similarity']
+    data = game_archive.read(columns, where=[('mode', '==', 'accurate')])
+    latest = {}
+    for row in sorted(range(len(data['game_id'])), key=lambda i: data['archived_at'][i]):
+        latest.pop(data['game_id'][row], None)
+        latest[data['game_id'][row]] = row
+    for game_id, row in latest.items():
+        leaderboard.record(game_id.decode('ascii'), int(data['final_score'][row]), {
+            'prompt_semantic': float(data['mean_prompt_semantic'][row]),
+            'prompt_levenshtein': float(data['mean_prompt_levenshtein'][row]),
+            'image_similarity': float(data['mean_image_similarity'][row])
+        })
+    return len(latest)
+
+if first_leaderboard_start:
+    logger.info("Leaderboard backfilled from the archive", extra={'games': backfill_leaderboard()})
+
+# Bumped on every change to a game, backs the /status ETag and long-poll
+game_versions = GameVersions()
+
+# Opt-in profiling: /api/debug/profile samples all threads, X-Profile runs one request under cProfile
+sampling_profiler = SamplingProfiler()
+init_request_profiling(app, PROFILING_TOKEN)
+
+def analysis_fingerprint(game, mode):
+    """Identify the inputs of an analysis - image hashes already identify their content"""
+    digest = hashlib.sha256(mode.encode())
+    for image_hash in game['images']:
+        digest.update(f"{image_hash}\n".encode())
+    for prompt in game['prompts']:
+        digest.update(f"{prompt['player']}:{prompt['prompt']}\n".encode())
+    return digest.hexdigest()
+
+def memoized_analysis(game, mode, fingerprint):
+    """The game's analysis in this mode if its inputs haven't changed since (each mode has its own)"""
+    if game.get('analysisFingerprints', {}).get(mode) == fingerprint:
+        return game['analyses'][mode]
+    return None
+
+def displayed_analysis(game):
+    """Accurate scores when the game has them (they are the ones ranked), otherwise fast ones"""
+    analyses = game.get('analyses', {})
+    return analyses.get('accurate') or analyses.get('fast')
+
+def run_flux(client, input_params, deadline):
+    """
+    Run flux-kontext-pro like client.run, but give up (and cancel the
+    prediction) once the request deadline has passed.
+    """
+    prediction = client.models.predictions.create(
+        model=("black-forest-labs", "flux-kontext-pro"),
+        input=input_params
+    )
+    while prediction.status not in ("succeeded", "failed", "canceled"):
+        if deadline.expired():
+            prediction.cancel()
+            raise DeadlineExceeded(f"Generation did not finish within the {deadline.seconds}s request deadline")
+        time.sleep(min(client.poll_interval, deadline.remaining()))
+        prediction.reload()
+    
+    if prediction.status != "succeeded":
+        raise replicate.exceptions.ModelError(prediction.error)
+    return prediction.output
+
+def generate_image(game_id, remaining_turns, prompt, image_path):
+    """Queue for a generation slot and run flux-kontext-pro on an image, within the request deadline"""
+    api_token = os.getenv("REPLICATE_API_TOKEN")
+    
+    # Don't hold a queue position for an upstream we already know is down
+    if replicate_breaker.is_open():
+        raise CircuitOpenError(replicate_breaker.name, replicate_breaker.retry_after())
+    if g.deadline.remaining() < MIN_GENERATION_BUDGET_SECONDS:
+        raise DeadlineExceeded(f"Less than {MIN_GENERATION_BUDGET_SECONDS}s of the request deadline left for a generation")
+    
+    with generation_scheduler.slot(game_id, remaining_turns, timeout=g.deadline.timeout()), open(image_path, "rb") as image_file:
+        client = replicate.Client(api_token=api_token, timeout=g.deadline.timeout(REPLICATE_HTTP_TIMEOUT_SECONDS))
+        input_params = {
+            "prompt": prompt,
+            "input_image": image_file,
+            "output_format": "jpg",
+            "temperature": 0.9,  # High temperature for more randomness
+            "guidance_scale": 7.5  # Lower guidance for more creative freedom
+        }
+        
+        return replicate_breaker.call(run_flux, client, input_params, g.deadline)
+
+def save_generated_image(output):
+    """Store a Replicate output and return its hash, or None for an unknown output type"""
+    if hasattr(output, 'read'):
+        # If output is a file-like object
+        return image_store.put_stream(output)
+    elif isinstance(output, str) and output.startswith('http'):
+        # If output is a URL, download it
+        # The generation has already succeeded, don't throw it away because the budget is nearly spent
+        response = requests.get(output, timeout=g.deadline.timeout(DOWNLOAD_TIMEOUT_SECONDS, floor=MIN_DOWNLOAD_TIMEOUT_SECONDS))
+        response.raise_for_status()
+        return image_store.put_bytes(response.content)
+    return None
+
+def upstream_unavailable_response(error):
+    """503 for an open breaker, 504 for a blown request deadline"""
+    if isinstance(error, CircuitOpenError):
+        response = jsonify({'error': str(error), 'retryAfter': error.retry_after})
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 503
+    return jsonify({'error': str(error)}), 504
+
+def generation_busy_response(error):
+    response = jsonify({
+        'error': 'Image generation is at capacity, please try again shortly',
+        'retryAfter': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.before_request
+def start_request_deadline():
+    budget = REQUEST_DEADLINE_SECONDS
+    requested = request.headers.get('X-Request-Timeout', type=float)
+    if requested and requested > 0:
+        budget = min(budget, requested)
+    g.deadline = Deadline(budget, shortened=budget < REQUEST_DEADLINE_SECONDS)
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    return jsonify({
+        'error': 'File too large',
+        'maxBytes': app.config['MAX_CONTENT_LENGTH']
+    }), 413
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy'})
 
+@app.route('/api/upstreams', methods=['GET'])
+def upstream_status():
+    """Circuit breaker state of each upstream, for monitoring"""
+    return jsonify({
+        'openai': openai_breaker.snapshot(),
+        'replicate': replicate_breaker.snapshot()
+    })
+
+@app.route('/api/debug/profile', methods=['GET'])
+def capture_profile():
+    """Sample every thread for ?seconds=N and return collapsed stacks or (?format=svg) a flame graph"""
+    if not check_profiling_token(request, PROFILING_TOKEN):
+        return jsonify({'error': 'Not found'}), 404
+    
+    seconds = request.args.get('seconds', 10, type=float)
+    output_format = request.args.get('format', 'collapsed')
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return jsonify({'error': f'seconds must be between 0 and {MAX_PROFILE_SECONDS}'}), 400
+    if output_format not in ('collapsed', 'svg'):
+        return jsonify({'error': 'format must be collapsed or svg'}), 400
+    
+    result = sampling_profiler.run(seconds)
+    if result is None:
+        return jsonify({'error': 'A profile is already being captured'}), 409
+    stacks, samples = result
+    logger.info("Profile captured", extra={'seconds': seconds, 'samples': samples, 'stacks': len(stacks)})
+    
+    if output_format == 'svg':
+        title = f'{samples} samples over {seconds:g}s'
+        return app.response_class(render_flame_graph(stacks, title), mimetype='image/svg+xml')
+    return app.response_class(collapse_stacks(stacks), mimetype='text/plain')
+
+@app.route('/api/generation/stats', methods=['GET'])
+def generation_stats():
+    return jsonify(generation_scheduler.stats())
+
 @app.route('/api/test-openai', methods=['GET'])
 def test_openai():
     """Test OpenAI API key and ChatGPT functionality"""
@@ -96,7 +369,9 @@ def create_game():
     if not 2 <= num_players <= 6:
         return jsonify({'error': 'Number of players must be between 2 and 6'}), 400
     
-    game_id = str(uuid.uuid4())
+    # Behind the shard dispatcher the ID is minted so it hashes to this worker
+    game_id = request.headers.get('X-Assigned-Game-Id') if SHARD_WORKER else None
+    game_id = game_id or str(uuid.uuid4())
     games[game_id] = {
         'id': game_id,
         'numPlayers': num_players,
@@ -104,8 +379,11 @@ def create_game():
         'images': [],
         'prompts': [],
         'status': 'waiting_for_image',
-        'originalImage': None
+        'originalImage': None,
+        'createdAt': time.time(),
+        'generationSeconds': []
     }
+    game_versions.bump(game_id)
     
     return jsonify({
         'gameId': game_id,
@@ -126,55 +404,42 @@ def upload_image(game_id):
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, f"{game_id}_{filename}")
-        file.save(file_path)
+        # Reject anything that isn't a sane image before doing any generation work
+        size, error = inspect_image(file.stream.name, MAX_IMAGE_PIXELS)
+        if error:
+            return jsonify({'error': error}), 400
+        logger.info("Upload accepted", extra={'width': size[0], 'height': size[1], 'bytes': file.stream.size})
         
-        games[game_id]['originalImage'] = file_path
-        games[game_id]['images'].append(file_path)
+        # The upload was hashed while it streamed in, so storing it is just a rename
+        image_hash = image_store.put_temp_file(file.stream.claim(), file.stream.hexdigest())
+        file_path = image_store.local_path(image_hash)
+        
+        games[game_id]['originalImage'] = image_hash
+        games[game_id]['images'].append(image_hash)
+        game_versions.bump(game_id)
         
         # Generate AI prompt and create first modification
         try:
             api_token = os.getenv("REPLICATE_API_TOKEN")
             if not api_token:
                 return jsonify({'error': 'REPLICATE_API_TOKEN not found in environment variables'}), 500
-                
-            client = replicate.Client(api_token=api_token)
             
             # Generate a wild, creative prompt using ChatGPT
             ai_prompt = generate_wild_ai_prompt()
             
-            print(f"AI generating first prompt: {ai_prompt}")
+            logger.info("AI generating first prompt", extra={'prompt': ai_prompt})
             
-            # Process the image with AI
-            with open(file_path, "rb") as image_file:
-                input_params = {
-                    "prompt": ai_prompt,
-                    "input_image": image_file,
-                    "output_format": "jpg",
-                    "temperature": 0.9,  # High temperature for more randomness
-                    "guidance_scale": 7.5  # Lower guidance for more creative freedom
-                }
-                
-                output = client.run(
-                    "black-forest-labs/flux-kontext-pro",
-                    input=input_params
-                )
+            # Process the image with AI - the opening AI turn is the furthest from completion
+            remaining_turns = games[game_id]['numPlayers']
+            generation_started = time.monotonic()
+            with log_stage(logger, 'generation'):
+                output = generate_image(game_id, remaining_turns, ai_prompt, file_path)
+            generation_seconds = time.monotonic() - generation_started
             
             # Save the AI-generated image
-            ai_image_path = os.path.join(IMAGES_FOLDER, f"{game_id}_ai_start.jpg")
-            
-            # Handle different types of output from Replicate
-            if hasattr(output, 'read'):
-                # If output is a file-like object
-                with open(ai_image_path, "wb") as file:
-                    file.write(output.read())
-            elif isinstance(output, str) and output.startswith('http'):
-                # If output is a URL, download it
-                response = requests.get(output)
-                with open(ai_image_path, "wb") as file:
-                    file.write(response.content)
-            else:
+            with log_stage(logger, 'save_output'):
+                ai_image_hash = save_generated_image(output)
+            if ai_image_hash is None:
                 return jsonify({'error': f'Unexpected output format from Replicate: {type(output)}'}), 500
             
             # Add AI prompt and image to game state
@@ -182,29 +447,47 @@ def upload_image(game_id):
                 'player': 'AI',
                 'prompt': ai_prompt
             })
-            games[game_id]['images'].append(ai_image_path)
+            games[game_id]['images'].append(ai_image_hash)
+            games[game_id]['generationSeconds'].append(generation_seconds)
             
             games[game_id]['status'] = 'ready'
+            game_versions.bump(game_id)
             
-            print(f"AI-generated image saved to: {ai_image_path}")
+            logger.info("AI-generated image saved", extra={'imageHash': ai_image_hash})
             
             return jsonify({
                 'message': 'Image uploaded and AI prompt generated successfully',
-                'imagePath': file_path,
-                'aiImagePath': ai_image_path,
+                'imageHash': image_hash,
+                'aiImageHash': ai_image_hash,
                 'aiPrompt': ai_prompt,
                 'status': 'ready'
             })
             
+        except GenerationQueueFull as e:
+            # Undo the upload so the client can simply retry it
+            games[game_id]['images'].remove(image_hash)
+            games[game_id]['originalImage'] = None
+            game_versions.bump(game_id)
+            image_store.release(image_hash)
+            return generation_busy_response(e)
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logger.warning("Skipping AI generation: %s", e)
+            # Same fallback as a failed generation, without waiting on the upstream
+            games[game_id]['status'] = 'ready'
+            game_versions.bump(game_id)
+            return jsonify({
+                'message': 'Image uploaded successfully (AI generation unavailable)',
+                'imageHash': image_hash,
+                'status': 'ready'
+            })
         except Exception as e:
-            import traceback
-            print(f"Error generating AI prompt: {str(e)}")
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error generating AI prompt: %s", e)
             # If AI generation fails, still allow the game to continue
             games[game_id]['status'] = 'ready'
+            game_versions.bump(game_id)
             return jsonify({
                 'message': 'Image uploaded successfully (AI prompt generation failed)',
-                'imagePath': file_path,
+                'imageHash': image_hash,
                 'status': 'ready'
             })
     
@@ -229,64 +512,43 @@ def submit_prompt(game_id):
         'player': current_player,
         'prompt': prompt
     })
+    game_versions.bump(game_id)
     
     # Process the image with AI
     try:
         api_token = os.getenv("REPLICATE_API_TOKEN")
         if not api_token:
             return jsonify({'error': 'REPLICATE_API_TOKEN not found in environment variables'}), 500
-            
-        client = replicate.Client(api_token=api_token)
         
         # Get the original image to modify (always use the first image)
-        original_image_path = game['images'][0]  # Always use the original image
+        original_image_path = image_store.local_path(game['images'][0])  # Always use the original image
         
         # Check if the original image file exists
         if not os.path.exists(original_image_path):
             return jsonify({'error': f'Original image file not found: {original_image_path}'}), 500
         
-        print(f"Processing original image: {original_image_path}")
-        print(f"Player {current_player} prompt: {prompt}")
-        print(f"Note: AI will modify the original image, not the previous player's image")
-        
-        # Read the original file and pass it as a file-like object
-        with open(original_image_path, "rb") as image_file:
-            input_params = {
-                "prompt": prompt,
-                "input_image": image_file,
-                "output_format": "jpg",
-                "temperature": 0.9,  # High temperature for more randomness
-                "guidance_scale": 7.5  # Lower guidance for more creative freedom
-            }
-            
-            print(f"Calling Replicate API with prompt: {prompt}")
-            
-            output = client.run(
-                "black-forest-labs/flux-kontext-pro",
-                input=input_params
-            )
+        # AI modifies the original image, not the previous player's image
+        logger.info("Calling Replicate API", extra={'player': current_player, 'prompt': prompt})
+        logger.debug("Processing original image", extra={'path': original_image_path})
+        
+        remaining_turns = game['numPlayers'] - current_player
+        generation_started = time.monotonic()
+        with log_stage(logger, 'generation', player=current_player):
+            output = generate_image(game_id, remaining_turns, prompt, original_image_path)
+        generation_seconds = time.monotonic() - generation_started
         
-        print(f"Replicate API response received: {type(output)}")
+        logger.debug("Replicate API response received", extra={'outputType': type(output).__name__})
         
         # Save the new image - handle different response types
-        new_image_path = os.path.join(IMAGES_FOLDER, f"{game_id}_player_{current_player}.jpg")
-        
-        # Handle different types of output from Replicate
-        if hasattr(output, 'read'):
-            # If output is a file-like object
-            with open(new_image_path, "wb") as file:
-                file.write(output.read())
-        elif isinstance(output, str) and output.startswith('http'):
-            # If output is a URL, download it
-            response = requests.get(output)
-            with open(new_image_path, "wb") as file:
-                file.write(response.content)
-        else:
+        with log_stage(logger, 'save_output', player=current_player):
+            new_image_hash = save_generated_image(output)
+        if new_image_hash is None:
             return jsonify({'error': f'Unexpected output format from Replicate: {type(output)}'}), 500
         
-        print(f"Image saved to: {new_image_path}")
+        logger.info("Image saved", extra={'player': current_player, 'imageHash': new_image_hash})
         
-        game['images'].append(new_image_path)
+        game['images'].append(new_image_hash)
+        game['generationSeconds'].append(generation_seconds)
         
         # Move to next player or end game
         if current_player < game['numPlayers']:
@@ -294,45 +556,88 @@ def submit_prompt(game_id):
             game['status'] = 'in_progress'
         else:
             game['status'] = 'completed'
+            game['completedAt'] = time.time()
+        game_versions.bump(game_id)
         
         return jsonify({
             'message': 'Prompt processed successfully',
-            'newImagePath': new_image_path,
+            'newImageHash': new_image_hash,
             'currentPlayer': game['currentPlayer'],
             'status': game['status'],
             'isGameComplete': game['status'] == 'completed'
         })
         
+    except GenerationQueueFull as e:
+        # Undo the prompt so the client can simply retry it
+        game['prompts'].pop()
+        game_versions.bump(game_id)
+        return generation_busy_response(e)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        # Undo the prompt so the client can simply retry it
+        game['prompts'].pop()
+        game_versions.bump(game_id)
+        return upstream_unavailable_response(e)
     except Exception as e:
-        import traceback
-        print(f"Error in submit_prompt: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception("Error in submit_prompt: %s", e)
         return jsonify({'error': f'Failed to process image: {str(e)}'}), 500
 
 @app.route('/api/game/<game_id>/status', methods=['GET'])
 def get_game_status(game_id):
+    """
+    Game state, versioned. Send If-None-Match with the last ETag to get a 304
+    when nothing changed; add ?waitForVersion=N&timeout=S to hold the request
+    until the game reaches version N (or S seconds pass).
+    """
     if game_id not in games:
         return jsonify({'error': 'Game not found'}), 404
     
+    wait_for_version = request.args.get('waitForVersion', type=int)
+    if wait_for_version is not None:
+        timeout = request.args.get('timeout', 30, type=float)
+        if not 0 <= timeout <= MAX_STATUS_WAIT_SECONDS:
+            return jsonify({'error': f'timeout must be between 0 and {MAX_STATUS_WAIT_SECONDS}'}), 400
+        game_versions.wait_for(game_id, wait_for_version, min(timeout, g.deadline.remaining()))
+        if game_id not in games:
+            return jsonify({'error': 'Game not found'}), 404
+    
+    # Read the version before the state, so a change in between only makes the next poll refetch
+    version = game_versions.current(game_id)
+    etag = f'{game_id}-{version}'
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
     game = games[game_id]
-    return jsonify({
+    response = jsonify({
         'gameId': game_id,
+        'version': version,
         'numPlayers': game['numPlayers'],
         'currentPlayer': game['currentPlayer'],
         'status': game['status'],
         'images': game['images'],
         'prompts': game['prompts'],
         'isGameComplete': game['status'] == 'completed',
-        'analysis': game.get('analysis', None)
+        'analysis': displayed_analysis(game),
+        'analyses': game.get('analyses', {})
     })
+    response.set_etag(etag)
+    # Let caches keep the body but always check the version with us
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/api/game/<game_id>/analyze', methods=['POST'])
 def analyze_game_results(game_id):
-    """Analyze game results using resultsViz"""
+    """Analyze game results using resultsViz (accurate) or fastScore (fast)"""
     try:
         if game_id not in games:
             return jsonify({'error': 'Game not found'}), 404
         
+        data = request.get_json(silent=True) or {}
+        mode = request.args.get('mode') or data.get('mode', 'accurate')
+        if mode not in ANALYSIS_MODES:
+            return jsonify({'error': f'Unknown analysis mode: {mode}'}), 400
+        
         game = games[game_id]
         if game['status'] != 'completed':
             return jsonify({'error': 'Game not completed yet'}), 400
@@ -341,99 +646,224 @@ def analyze_game_results(game_id):
         if len(game['prompts']) < 2 or len(game['images']) < 3:
             return jsonify({'error': 'Not enough data for analysis'}), 400
         
-        # Extract data for analysis
-        # We want to compare ALL interpretations against the original image
-        # This includes the AI's modification and all player modifications
-        
-        # The original image is at index 0, all modifications start at index 1
-        original_image = game['images'][0]  # Original uploaded image
-        all_modified_images = game['images'][1:]  # AI + Player modifications
-        
-        # For prompts, we compare all prompts against the original (empty) or include AI as first player
-        # Since we don't have an "original prompt", we'll treat the AI prompt as the reference
-        ai_prompt = game['prompts'][0]['prompt']  # First AI prompt
-        all_prompts = [prompt['prompt'] for prompt in game['prompts']]  # AI + Player prompts
-        
-        # Debug: Print the data being passed to analysis
-        print(f"Analysis data:")
-        print(f"Original image: {original_image}")
-        print(f"AI prompt: {ai_prompt}")
-        print(f"All prompts: {all_prompts}")
-        print(f"All modified images: {all_modified_images}")
-        print(f"Original image exists: {os.path.exists(original_image)}")
-        for i, img in enumerate(all_modified_images):
-            print(f"Modified image {i+1} exists: {os.path.exists(img)}")
-        
-        # Run the analysis - compare all modified images against original image
-        # and all prompts against the AI prompt (treating AI as first player)
-        try:
-            results = analyze_results(ai_prompt, all_prompts, original_image, all_modified_images)
-            
-            # Validate that all result arrays have the same length
-            prompt_semantic_count = len(results['prompt_semantic_scores'])
-            prompt_levenshtein_count = len(results['prompt_levenshtein_scores'])
-            image_similarity_count = len(results['image_similarity_scores'])
-            total_count = len(all_prompts)
-            
-            print(f"Analysis validation:")
-            print(f"Total players (including AI): {total_count}")
-            print(f"Prompt semantic scores: {prompt_semantic_count}")
-            print(f"Prompt levenshtein scores: {prompt_levenshtein_count}")
-            print(f"Image similarity scores: {image_similarity_count}")
-            
-            if not (prompt_semantic_count == prompt_levenshtein_count == image_similarity_count == total_count):
-                print(f"WARNING: Array length mismatch! All should be {total_count}")
-                # Truncate arrays to the shortest length
-                min_length = min(prompt_semantic_count, prompt_levenshtein_count, image_similarity_count, total_count)
-                results['prompt_semantic_scores'] = results['prompt_semantic_scores'][:min_length]
-                results['prompt_levenshtein_scores'] = results['prompt_levenshtein_scores'][:min_length]
-                results['image_similarity_scores'] = results['image_similarity_scores'][:min_length]
-                print(f"Truncated all arrays to length: {min_length}")
-                
-        except Exception as analysis_error:
-            print(f"ML analysis failed, using fallback: {analysis_error}")
-            # Fallback to placeholder results
-            num_players = len(all_prompts)
-            results = {
-                'prompt_semantic_scores': [0.5 + random.uniform(-0.2, 0.2) for _ in range(num_players)],
-                'prompt_levenshtein_scores': [0.3 + random.uniform(-0.1, 0.1) for _ in range(num_players)],
-                'image_similarity_scores': [0.6 + random.uniform(-0.2, 0.2) for _ in range(num_players)]
-            }
-            print("Using fallback analysis results")
-        
-        # Calculate final score
-        mean_cos_sim_prompt = sum(results['prompt_semantic_scores']) / len(results['prompt_semantic_scores'])
-        mean_cos_sim_image = sum(results['image_similarity_scores']) / len(results['image_similarity_scores'])
-        mean_lev = sum(results['prompt_levenshtein_scores']) / len(results['prompt_levenshtein_scores'])
-
-        normalized_sim_prompt = (mean_cos_sim_prompt + 1) / 2
-        normalized_sim_image = (mean_cos_sim_image + 1) / 2
-
-        final_score = int(mean_lev * 100 + normalized_sim_prompt * 100 + normalized_sim_image * 100)
-        
-        # Add analysis results to game data
-        game['analysis'] = {
-            'final_score': final_score,
-            'prompt_semantic_scores': results['prompt_semantic_scores'],
-            'prompt_levenshtein_scores': results['prompt_levenshtein_scores'],
-            'image_similarity_scores': results['image_similarity_scores']
-        }
+        fingerprint = analysis_fingerprint(game, mode)
+        analysis = memoized_analysis(game, mode, fingerprint)
+        if analysis is not None:
+            return jsonify(dict(analysis, cached=True, shared=False))
         
-        return jsonify({
-            'final_score': final_score,
-            'prompt_semantic_scores': results['prompt_semantic_scores'],
-            'prompt_levenshtein_scores': results['prompt_levenshtein_scores'],
-            'image_similarity_scores': results['image_similarity_scores']
-        })
+        def analyze_once():
+            # A request that missed the memo just before the previous computation stored it
+            analysis = memoized_analysis(game, mode, fingerprint)
+            if analysis is not None:
+                return analysis, True
+            return run_game_analysis(game_id, game, mode, fingerprint), False
+        
+        # Concurrent requests for the same game share one computation
+        (analysis, cached), shared = analysis_flight.do((game_id, fingerprint), analyze_once)
+        
+        return jsonify(dict(analysis, cached=cached, shared=shared))
         
     except Exception as e:
-        import traceback
-        logging.error(f"Error analyzing game results: {e}")
-        logging.error(f"Traceback: {traceback.format_exc()}")
-        print(f"Error analyzing game results: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception("Error analyzing game results: %s", e)
         return jsonify({'error': f'Failed to analyze game results: {str(e)}'}), 500
 
+def run_game_analysis(game_id, game, mode, fingerprint):
+    """Score a completed game, record it and memoize the analysis on the game"""
+    analysis_started = time.monotonic()
+    
+    # Extract data for analysis
+    # We want to compare ALL interpretations against the original image
+    # This includes the AI's modification and all player modifications
+    
+    # The original image is at index 0, all modifications start at index 1
+    original_image = image_store.local_path(game['images'][0])  # Original uploaded image
+    all_modified_images = [image_store.local_path(h) for h in game['images'][1:]]  # AI + Player modifications
+    
+    # For prompts, we compare all prompts against the original (empty) or include AI as first player
+    # Since we don't have an "original prompt", we'll treat the AI prompt as the reference
+    ai_prompt = game['prompts'][0]['prompt']  # First AI prompt
+    all_prompts = [prompt['prompt'] for prompt in game['prompts']]  # AI + Player prompts
+    
+    # Debug: Log the data being passed to analysis
+    logger.debug("Analysis data", extra={
+        'mode': mode,
+        'originalImage': original_image,
+        'aiPrompt': ai_prompt,
+        'prompts': all_prompts,
+        'modifiedImages': all_modified_images
+    })
+    
+    # Run the analysis - compare all modified images against original image
+    # and all prompts against the AI prompt (treating AI as first player)
+    fallback = False
+    try:
+        with log_stage(logger, 'scoring', mode=mode):
+            if mode == 'fast':
+                results = fast_analyze_results(ai_prompt, all_prompts, original_image, all_modified_images)
+            else:
+                results = analyze_results(ai_prompt, all_prompts, original_image, all_modified_images)
+    
+        # Validate that all result arrays have the same length
+        prompt_semantic_count = len(results['prompt_semantic_scores'])
+        prompt_levenshtein_count = len(results['prompt_levenshtein_scores'])
+        image_similarity_count = len(results['image_similarity_scores'])
+        total_count = len(all_prompts)
+    
+        if not (prompt_semantic_count == prompt_levenshtein_count == image_similarity_count == total_count):
+            logger.warning("Analysis array length mismatch", extra={
+                'expected': total_count,
+                'promptSemantic': prompt_semantic_count,
+                'promptLevenshtein': prompt_levenshtein_count,
+                'imageSimilarity': image_similarity_count
+            })
+            # Truncate arrays to the shortest length
+            min_length = min(prompt_semantic_count, prompt_levenshtein_count, image_similarity_count, total_count)
+            results['prompt_semantic_scores'] = results['prompt_semantic_scores'][:min_length]
+            results['prompt_levenshtein_scores'] = results['prompt_levenshtein_scores'][:min_length]
+            results['image_similarity_scores'] = results['image_similarity_scores'][:min_length]
+            logger.warning("Truncated all arrays to length %d", min_length)
+    
+    except Exception as analysis_error:
+        logger.warning("ML analysis failed, using fallback results: %s", analysis_error)
+        # Fallback to placeholder results
+        fallback = True
+        num_players = len(all_prompts)
+        results = {
+            'prompt_semantic_scores': [0.5 + random.uniform(-0.2, 0.2) for _ in range(num_players)],
+            'prompt_levenshtein_scores': [0.3 + random.uniform(-0.1, 0.1) for _ in range(num_players)],
+            'image_similarity_scores': [0.6 + random.uniform(-0.2, 0.2) for _ in range(num_players)]
+        }
+    
+    # Calculate final score
+    mean_cos_sim_prompt = sum(results['prompt_semantic_scores']) / len(results['prompt_semantic_scores'])
+    mean_cos_sim_image = sum(results['image_similarity_scores']) / len(results['image_similarity_scores'])
+    mean_lev = sum(results['prompt_levenshtein_scores']) / len(results['prompt_levenshtein_scores'])
+    
+    normalized_sim_prompt = (mean_cos_sim_prompt + 1) / 2
+    normalized_sim_image = (mean_cos_sim_image + 1) / 2
+    
+    final_score = int(mean_lev * 100 + normalized_sim_prompt * 100 + normalized_sim_image * 100)
+    
+    # Add analysis results to game data
+    analysis = {
+        'mode': mode,
+        'final_score': final_score,
+        'prompt_semantic_scores': results['prompt_semantic_scores'],
+        'prompt_levenshtein_scores': results['prompt_levenshtein_scores'],
+        'image_similarity_scores': results['image_similarity_scores']
+    }
+    # One memo slot per mode, so a fast run never replaces the accurate (ranked) analysis
+    analyses = game.setdefault('analyses', {})
+    fingerprints = game.setdefault('analysisFingerprints', {})
+    if fallback:
+        # Placeholder scores are shown but not memoized, ranked, indexed or archived,
+        # so the next /analyze call retries the models
+        analysis['fallback'] = True
+        analyses[mode] = analysis
+        fingerprints[mode] = None
+        if mode == 'accurate':
+            leaderboard.remove(game_id)
+        game_versions.bump(game_id)
+        return analysis
+    
+    analyses[mode] = analysis
+    fingerprints[mode] = fingerprint
+    game_versions.bump(game_id)
+    logger.info("Game analyzed", extra={'mode': mode, 'finalScore': final_score})
+    
+    # Fast-tier scores are not comparable with ViT/MiniLM ones, keep them off the leaderboard
+    if mode == 'accurate':
+        leaderboard.record(game_id, final_score, {
+            'prompt_semantic': mean_cos_sim_prompt,
+            'prompt_levenshtein': mean_lev,
+            'image_similarity': mean_cos_sim_image
+        })
+    
+    if results.get('prompt_embeddings') and results.get('image_embeddings'):
+        # Re-analysis replaces the game's previous vectors
+        prompt_vectors.remove(game_id)
+        image_vectors.remove(game_id)
+        prompt_vectors.add(game_id, results['prompt_embeddings'])
+        image_vectors.add(game_id, results['image_embeddings'])
+    
+    # The archive is an analytics copy, losing a row must not fail the analysis
+    try:
+        with log_stage(logger, 'archive'):
+            game_archive.append(
+                game_id, game, analysis, time.monotonic() - analysis_started,
+                results.get('prompt_embeddings') or (), results.get('image_embeddings') or ()
+            )
+    except Exception as e:
+        logger.exception("Archiving analysis failed: %s", e)
+    
+    return analysis
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    limit = request.args.get('limit', 10, type=int)
+    if not 1 <= limit <= 1000:
+        return jsonify({'error': 'limit must be between 1 and 1000'}), 400
+    
+    return jsonify({
+        'totalGames': len(leaderboard),
+        'entries': leaderboard.top(limit)
+    })
+
+@app.route('/api/game/<game_id>/percentile', methods=['GET'])
+def get_game_percentile(game_id):
+    standing = leaderboard.rank(game_id)
+    if standing is None:
+        return jsonify({'error': 'Game has no final score yet'}), 404
+    
+    return jsonify(standing)
+
+@app.route('/api/search/similar', methods=['GET'])
+def search_similar_games():
+    """Find past games whose prompts or images are closest to a given game's"""
+    game_id = request.args.get('gameId')
+    k = request.args.get('k', 10, type=int)
+    if not game_id:
+        return jsonify({'error': 'gameId is required'}), 400
+    if not 1 <= k <= 100:
+        return jsonify({'error': 'k must be between 1 and 100'}), 400
+    if not prompt_vectors.has(game_id) and not image_vectors.has(game_id):
+        return jsonify({'error': 'Game has not been analyzed yet'}), 404
+    
+    matches = {}
+    duplicate_uploads = []
+    reused_prompts = []
+    
+    for kind, index in (('prompt', prompt_vectors), ('image', image_vectors)):
+        for position, vector in index.vectors_for(game_id):
+            for other_game, other_position, score in index.search(vector, k, exclude_game=game_id):
+                match = matches.setdefault(other_game, {'gameId': other_game, 'promptSimilarity': None, 'imageSimilarity': None})
+                key = f'{kind}Similarity'
+                if match[key] is None or score > match[key]:
+                    match[key] = score
+                
+                # Position 0 of the image index is the original upload
+                if kind == 'image' and position == 0 and other_position == 0 and score >= DUPLICATE_IMAGE_THRESHOLD:
+                    duplicate_uploads.append({'gameId': other_game, 'similarity': score})
+                if kind == 'prompt' and score >= REUSED_PROMPT_THRESHOLD:
+                    reused_prompts.append({
+                        'prompt': position,
+                        'gameId': other_game,
+                        'otherPrompt': other_position,
+                        'similarity': score
+                    })
+    
+    def overall(match):
+        scores = [s for s in (match['promptSimilarity'], match['imageSimilarity']) if s is not None]
+        return sum(scores) / 2
+    
+    similar = sorted(matches.values(), key=overall, reverse=True)[:k]
+    return jsonify({
+        'gameId': game_id,
+        'similarGames': similar,
+        'duplicateUploads': duplicate_uploads,
+        'reusedPrompts': reused_prompts
+    })
+
 @app.route('/api/game/<game_id>/image/<int:image_index>', methods=['GET'])
 def get_image(game_id, image_index):
     if game_id not in games:
@@ -443,8 +873,16 @@ def get_image(game_id, image_index):
     if image_index >= len(game['images']):
         return jsonify({'error': 'Image index out of range'}), 404
     
-    image_path = game['images'][image_index]
-    return send_file(image_path, mimetype='image/jpeg')
+    image_hash = game['images'][image_index]
+    kind, location = image_store.serve(image_hash)
+    if kind == 'url':
+        return redirect(location)
+    
+    # The blob behind this URL changes on reset or a rolled-back upload, so caches
+    # must revalidate; the content hash as ETag turns that into a cheap 304
+    response = send_file(location, mimetype='image/jpeg', etag=image_hash, conditional=True)
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/api/game/<game_id>/reset', methods=['POST'])
 def reset_game(game_id):
@@ -453,6 +891,7 @@ def reset_game(game_id):
     
     # Keep the same game ID but reset the state
     num_players = games[game_id]['numPlayers']
+    discard_game_data(game_id)
     games[game_id] = {
         'id': game_id,
         'numPlayers': num_players,
@@ -460,8 +899,11 @@ def reset_game(game_id):
         'images': [],
         'prompts': [],
         'status': 'waiting_for_image',
-        'originalImage': None
+        'originalImage': None,
+        'createdAt': time.time(),
+        'generationSeconds': []
     }
+    game_versions.bump(game_id)
     
     return jsonify({
         'message': 'Game reset successfully',
@@ -469,6 +911,94 @@ def reset_game(game_id):
         'status': 'waiting_for_image'
     })
 
+def discard_game_data(game_id):
+    """Release everything a game holds outside the games dict"""
+    for image_hash in games[game_id]['images']:
+        image_store.release(image_hash)
+    leaderboard.remove(game_id)
+    prompt_vectors.remove(game_id)
+    image_vectors.remove(game_id)
+
+@app.route('/api/leaderboard/counts', methods=['GET'])
+def get_leaderboard_counts():
+    score = request.args.get('score', type=float)
+    if score is None:
+        return jsonify({'error': 'score is required'}), 400
+    return jsonify(leaderboard.counts(score))
+
+# Internal routes used by shard_dispatcher to track load and move games between workers
+
+@app.route('/api/internal/games', methods=['GET'])
+def list_shard_games():
+    if not SHARD_WORKER:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({
+        'gameIds': list(games),
+        'activeGames': sum(1 for game in games.values() if game['status'] != 'completed')
+    })
+
+@app.route('/api/internal/games/<game_id>', methods=['GET'])
+def export_shard_game(game_id):
+    if not SHARD_WORKER:
+        return jsonify({'error': 'Not found'}), 404
+    if game_id not in games:
+        return jsonify({'error': 'Game not found'}), 404
+    
+    game = games[game_id]
+    images = []
+    for image_hash in game['images']:
+        with open(image_store.local_path(image_hash), 'rb') as f:
+            images.append(base64.b64encode(f.read()).decode('ascii'))
+    return jsonify({
+        'game': game,
+        'images': images,
+        'version': game_versions.current(game_id),
+        # The memoized analysis moves with the game, so its vectors must too or it drops out of search
+        'promptVectors': [vector.tolist() for _, vector in prompt_vectors.vectors_for(game_id)],
+        'imageVectors': [vector.tolist() for _, vector in image_vectors.vectors_for(game_id)]
+    })
+
+@app.route('/api/internal/games/<game_id>', methods=['PUT'])
+def import_shard_game(game_id):
+    if not SHARD_WORKER:
+        return jsonify({'error': 'Not found'}), 404
+    
+    data = request.get_json()
+    game = data['game']
+    # One reference per image entry, the same as if the game had been played here
+    hashes = [image_store.put_bytes(base64.b64decode(image)) for image in data['images']]
+    if hashes != game['images']:
+        for image_hash in hashes:
+            image_store.release(image_hash)
+        return jsonify({'error': 'Image content does not match the game record'}), 400
+    
+    games[game_id] = game
+    game_versions.advance_to(game_id, data.get('version', 0))
+    for index, vectors in ((prompt_vectors, data.get('promptVectors')), (image_vectors, data.get('imageVectors'))):
+        if vectors:
+            index.remove(game_id)
+            index.add(game_id, vectors)
+    analysis = game.get('analyses', {}).get('accurate')
+    if analysis and not analysis.get('fallback'):
+        leaderboard.record(game_id, analysis['final_score'], {
+            'prompt_semantic': sum(analysis['prompt_semantic_scores']) / len(analysis['prompt_semantic_scores']),
+            'prompt_levenshtein': sum(analysis['prompt_levenshtein_scores']) / len(analysis['prompt_levenshtein_scores']),
+            'image_similarity': sum(analysis['image_similarity_scores']) / len(analysis['image_similarity_scores'])
+        })
+    return jsonify({'gameId': game_id, 'status': 'imported'})
+
+@app.route('/api/internal/games/<game_id>', methods=['DELETE'])
+def drop_shard_game(game_id):
+    if not SHARD_WORKER:
+        return jsonify({'error': 'Not found'}), 404
+    if game_id not in games:
+        return jsonify({'error': 'Game not found'}), 404
+    
+    discard_game_data(game_id)
+    del games[game_id]
+    game_versions.discard(game_id)
+    return jsonify({'gameId': game_id, 'status': 'dropped'})
+
 def generate_wild_ai_prompt():
     """Generate a wild, creative prompt using ChatGPT that will dramatically alter an image"""
     try:
@@ -478,8 +1008,12 @@ def generate_wild_ai_prompt():
             # Fallback to hardcoded prompts if no API key
             return generate_fallback_prompt()
         
-        # Configure OpenAI client
-        openai = OpenAI(api_key=openai_api_key)
+        # Skip straight to the fallback while OpenAI is failing or slow
+        if openai_breaker.is_open():
+            return generate_fallback_prompt()
+        
+        # Configure OpenAI client - retries are left to the breaker, the timeout to the request budget
+        openai = OpenAI(api_key=openai_api_key, timeout=g.deadline.timeout(OPENAI_TIMEOUT_SECONDS), max_retries=0)
         
         # Create a system prompt that encourages wild, creative transformations
         system_prompt = """You are an AI artist who specializes in creating absolutely wild, vibey, and mind-bending image modifications. Your job is to take an existing image and add crazy, unexpected elements, creatures, or effects, while keeping the original image partially visible and recognizable.
@@ -517,7 +1051,8 @@ AVOID prompts that:
 Generate ONE wild, vibey prompt that will add crazy new elements while keeping the original image partially visible and creating an amazing, energetic atmosphere."""
 
         # Generate the prompt using ChatGPT
-        response = openai.chat.completions.create(
+        response = openai_breaker.call(
+            openai.chat.completions.create,
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -537,7 +1072,7 @@ Generate ONE wild, vibey prompt that will add crazy new elements while keeping t
         return ai_prompt
         
     except Exception as e:
-        print(f"Error generating ChatGPT prompt: {str(e)}")
+        logger.warning("Error generating ChatGPT prompt: %s", e)
         # Fallback to hardcoded prompts
         return generate_fallback_prompt()
 
@@ -572,29 +1107,29 @@ def generate_fallback_prompt():
 def test_ml_models():
     """Test if ML models can load properly"""
     try:
-        print("Testing ML model loading...")
+        logger.info("Testing ML model loading")
         
         # Test sentence transformer
-        print("Loading sentence transformer...")
+        logger.info("Loading sentence transformer")
         from sentence_transformers import SentenceTransformer
         model = SentenceTransformer('all-MiniLM-L6-v2')
-        print("✓ Sentence transformer loaded successfully")
+        logger.info("Sentence transformer loaded successfully")
         
         # Test ViT model
-        print("Loading ViT model...")
+        logger.info("Loading ViT model")
         from transformers import ViTFeatureExtractor, ViTModel
         feature_extractor = ViTFeatureExtractor.from_pretrained("google/vit-base-patch16-224-in21k")
         vit_model = ViTModel.from_pretrained("google/vit-base-patch16-224-in21k")
-        print("✓ ViT model loaded successfully")
+        logger.info("ViT model loaded successfully")
         
         # Test basic functionality
-        print("Testing basic functionality...")
+        logger.info("Testing basic functionality")
         test_prompt1 = "A cat sitting on a chair"
         test_prompt2 = "A dog lying on a couch"
         
         emb1 = model.encode(test_prompt1, convert_to_tensor=True)
         emb2 = model.encode(test_prompt2, convert_to_tensor=True)
-        print("✓ Sentence encoding works")
+        logger.info("Sentence encoding works")
         
         return jsonify({
             'status': 'success',
@@ -603,9 +1138,7 @@ def test_ml_models():
         })
         
     except Exception as e:
-        import traceback
-        print(f"ML model test failed: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception("ML model test failed: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'ML model test failed: {str(e)}',
@@ -613,4 +1146,8 @@ def test_ml_models():
         }), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    app.run(
+        debug=os.getenv('FLASK_DEBUG', 'True') == 'True',
+        host=os.getenv('FLASK_HOST', '0.0.0.0'),
+        port=int(os.getenv('FLASK_PORT', 5000))
+    ) 
\ No newline at end of file
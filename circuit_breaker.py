@@ -0,0 +1,137 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable (circuit open), retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker.
+
+    The outcomes of the last ``window`` calls are kept; a call counts as bad if
+    it raised or took longer than ``slow_call_seconds``. Once at least
+    ``min_calls`` are recorded and the bad share reaches ``failure_rate`` the
+    breaker opens and calls fail immediately for ``open_seconds``. After that a
+    single probe call is let through (half open): success closes the breaker,
+    failure opens it again.
+
+    ``neutral`` is an optional predicate on the exception a call raised; when
+    it returns True the failure is blamed on the caller (e.g. its own time
+    budget ran out) and is not recorded at all, unless the call was already
+    slower than ``slow_call_seconds``.
+    """
+
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5, slow_call_seconds=None, open_seconds=30,
+                 neutral=None):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.neutral = neutral
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = 'closed'
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._times_opened = 0
+
+    def _open_locked(self):
+        self._state = 'open'
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._times_opened += 1
+
+    def _retry_after_locked(self):
+        remaining = self._opened_at + self.open_seconds - time.monotonic()
+        return max(1, math.ceil(remaining))
+
+    def is_open(self):
+        """True while calls would be rejected, without claiming the half-open probe"""
+        with self._lock:
+            if self._state == 'open':
+                return time.monotonic() < self._opened_at + self.open_seconds
+            return self._state == 'half_open' and self._probe_in_flight
+
+    def retry_after(self):
+        with self._lock:
+            return self._retry_after_locked()
+
+    def allow(self):
+        with self._lock:
+            if self._state == 'open':
+                if time.monotonic() < self._opened_at + self.open_seconds:
+                    return False
+                self._state = 'half_open'
+            if self._state == 'half_open':
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def _is_slow(self, duration):
+        return self.slow_call_seconds is not None and duration is not None and duration > self.slow_call_seconds
+
+    def record(self, success, duration=None):
+        bad = not success or self._is_slow(duration)
+        with self._lock:
+            if self._state == 'half_open':
+                if bad:
+                    self._open_locked()
+                else:
+                    self._state = 'closed'
+                    self._probe_in_flight = False
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append(bad)
+            if len(self._outcomes) >= self.min_calls and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                self._open_locked()
+                self._outcomes.clear()
+
+    def release(self):
+        """Give back a call slot without recording an outcome"""
+        with self._lock:
+            if self._state == 'half_open':
+                self._probe_in_flight = False
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            duration = time.monotonic() - started
+            if self.neutral is not None and self.neutral(e) and not self._is_slow(duration):
+                self.release()
+            else:
+                self.record(False, duration)
+            raise
+        self.record(True, time.monotonic() - started)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            state = self._state
+            if state == 'open' and time.monotonic() >= self._opened_at + self.open_seconds:
+                state = 'half_open'
+            return {
+                'name': self.name,
+                'state': state,
+                'recentCalls': len(self._outcomes),
+                'recentFailureRate': round(sum(self._outcomes) / len(self._outcomes), 3) if self._outcomes else 0.0,
+                'timesOpened': self._times_opened,
+                'retryAfter': self._retry_after_locked() if state == 'open' else 0
+            }
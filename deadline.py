@@ -0,0 +1,39 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has used up its time budget"""
+
+
+class Deadline:
+    """
+    End-to-end time budget for one request.
+
+    Upstream calls ask it for their timeout, so a call late in the request only
+    gets whatever is left instead of its full default.
+    """
+
+    def __init__(self, seconds, shortened=False):
+        self.seconds = seconds
+        # True when the client asked for less than the server's default budget
+        self.shortened = shortened
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None, floor=None):
+        """
+        Seconds an upstream call may take: the remaining budget, at most cap.
+        With a floor the call always gets at least that long, even past the
+        deadline (for work that must finish once it has been paid for).
+        """
+        remaining = self.remaining()
+        if floor is not None:
+            remaining = max(floor, remaining)
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds}s exceeded")
+        return remaining if cap is None else min(cap, remaining)
@@ -0,0 +1,173 @@
+"""
+Fast scoring tier for quick in-game feedback.
+
+Images are compared with a DCT perceptual hash and a color histogram computed
+with NumPy from small downscaled copies, so no model has to be loaded. The
+per-image features are cached, which makes each extra comparison against the
+same reference a few microseconds. Prompts use Levenshtein plus a bag-of-words
+cosine as a cheap stand-in for the MiniLM semantic score.
+"""
+import os
+import re
+import sys
+from collections import Counter
+from functools import lru_cache
+
+import Levenshtein
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+HASH_IMAGE_SIZE = 32
+HIST_IMAGE_SIZE = 64
+HIST_BINS = 8
+
+# Weight of the perceptual hash vs the color histogram in the image score
+HASH_WEIGHT = 0.6
+
+
+def _dctMatrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT = _dctMatrix(HASH_IMAGE_SIZE)
+
+
+@lru_cache(maxsize=1024)
+def _imageFeatures(image_path, mtime):
+    # mtime is only part of the cache key so overwritten files are recomputed
+    with Image.open(image_path) as image:
+        image.draft("RGB", (HIST_IMAGE_SIZE * 2, HIST_IMAGE_SIZE * 2))
+        rgb = image.convert("RGB")
+
+    gray = np.asarray(rgb.convert("L").resize((HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), Image.BILINEAR), dtype=np.float64)
+    dct = _DCT @ gray @ _DCT.T
+    low = dct[:HASH_SIZE, :HASH_SIZE].flatten()
+    # Median without the DC term, which only encodes overall brightness
+    phash = np.packbits(low > np.median(low[1:]))
+
+    small = np.asarray(rgb.resize((HIST_IMAGE_SIZE, HIST_IMAGE_SIZE), Image.BILINEAR), dtype=np.uint8)
+    quantized = (small // (256 // HIST_BINS)).reshape(-1, 3).astype(np.int32)
+    codes = quantized[:, 0] * HIST_BINS * HIST_BINS + quantized[:, 1] * HIST_BINS + quantized[:, 2]
+    hist = np.bincount(codes, minlength=HIST_BINS ** 3).astype(np.float64)
+    hist /= hist.sum()
+
+    return phash, hist
+
+def imageFeatures(image_path):
+    return _imageFeatures(image_path, os.path.getmtime(image_path))
+
+def hashScoreImage(image1, image2):
+    """1 - normalized Hamming distance between the perceptual hashes"""
+    hash1, _ = imageFeatures(image1)
+    hash2, _ = imageFeatures(image2)
+    distance = int(np.unpackbits(hash1 ^ hash2).sum())
+    return 1 - distance / (HASH_SIZE * HASH_SIZE)
+
+def histScoreImage(image1, image2):
+    """Histogram intersection of the quantized RGB color distributions"""
+    _, hist1 = imageFeatures(image1)
+    _, hist2 = imageFeatures(image2)
+    return float(np.minimum(hist1, hist2).sum())
+
+def fastScoreImage(image1, image2):
+    return HASH_WEIGHT * hashScoreImage(image1, image2) + (1 - HASH_WEIGHT) * histScoreImage(image1, image2)
+
+def fastScore(prompt1, prompt2):
+    """Cosine similarity of word counts"""
+    words1 = Counter(re.findall(r"\w+", prompt1.lower()))
+    words2 = Counter(re.findall(r"\w+", prompt2.lower()))
+    dot = sum(count * words2[word] for word, count in words1.items())
+    norm = np.sqrt(sum(c * c for c in words1.values())) * np.sqrt(sum(c * c for c in words2.values()))
+    return float(dot / norm) if norm else 0.0
+
+def levScore(prompt1, prompt2):
+    longest = max(len(prompt1), len(prompt2))
+    if longest == 0:
+        return 1.0
+    return 1 - (Levenshtein.distance(prompt1, prompt2) / longest)
+
+def main(reference_prompt, example_prompts, reference_image, example_images):
+    """
+    Fast-tier equivalent of resultsViz.main: same arguments and result keys, no plots.
+    """
+    return {
+        'reference_prompt': reference_prompt,
+        'reference_image': reference_image,
+        'prompt_semantic_scores': [fastScore(reference_prompt, p) for p in example_prompts],
+        'prompt_levenshtein_scores': [levScore(reference_prompt, p) for p in example_prompts],
+        'image_similarity_scores': [fastScoreImage(reference_image, img) for img in example_images]
+    }
+
+# Fixture images and prompts the calibration report runs on by default
+CALIBRATION_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "calibration")
+
+def _agreement(fast_scores, model_scores):
+    """How well the fast scores track the model scores over the same pairs"""
+    fast = np.array(fast_scores)
+    model = np.array(model_scores)
+    fast_ranks = fast.argsort().argsort()
+    model_ranks = model.argsort().argsort()
+    slope, intercept = np.polyfit(fast, model, 1)
+    residuals = model - (slope * fast + intercept)
+
+    return {
+        'pairs': len(fast_scores),
+        'pearson': float(np.corrcoef(fast, model)[0, 1]),
+        'spearman': float(np.corrcoef(fast_ranks, model_ranks)[0, 1]),
+        'slope': float(slope),
+        'intercept': float(intercept),
+        'rmse': float(np.sqrt(np.mean(residuals ** 2)))
+    }
+
+def calibrate(image_paths, prompts):
+    """
+    Compare the fast image score against the ViT cosine similarity, and the
+    bag-of-words prompt score against the MiniLM one, for every pair of
+    fixture images and prompts, and report how well they agree.
+    """
+    from resultsViz import simScore, simScoreImage
+
+    if len(image_paths) < 3 or len(prompts) < 3:
+        raise ValueError("Calibration needs at least 3 fixture images and 3 fixture prompts")
+
+    image_pairs = [(a, b) for i, a in enumerate(image_paths) for b in image_paths[i + 1:]]
+    prompt_pairs = [(a, b) for i, a in enumerate(prompts) for b in prompts[i + 1:]]
+
+    return {
+        'images': _agreement(
+            [fastScoreImage(a, b) for a, b in image_pairs],
+            [simScoreImage(a, b) for a, b in image_pairs]
+        ),
+        'prompts': _agreement(
+            [fastScore(a, b) for a, b in prompt_pairs],
+            [simScore(a, b) for a, b in prompt_pairs]
+        )
+    }
+
+def loadFixtures(fixture_dir):
+    """Images in fixture_dir and the prompts in its prompts.txt (one per line)"""
+    images = sorted(
+        os.path.join(fixture_dir, name) for name in os.listdir(fixture_dir)
+        if name.lower().endswith(('.png', '.jpg', '.jpeg'))
+    )
+    with open(os.path.join(fixture_dir, "prompts.txt"), encoding="utf-8") as f:
+        prompts = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return images, prompts
+
+
+# Calibration report: python fastScore.py [fixture directory, fixtures/calibration by default]
+if __name__ == "__main__":
+    fixture_dir = sys.argv[1] if len(sys.argv) > 1 else CALIBRATION_FIXTURES
+    images, prompts = loadFixtures(fixture_dir)
+
+    report = calibrate(images, prompts)
+    for label, model, count in (("images", "ViT", len(images)), ("prompts", "MiniLM", len(prompts))):
+        stats = report[label]
+        print(f"Fixture {label}: {count} ({stats['pairs']} pairs)")
+        print(f"  Pearson correlation with {model}:  {stats['pearson']:.3f}")
+        print(f"  Spearman correlation with {model}: {stats['spearman']:.3f}")
+        print(f"  Linear fit: {model.lower()} = {stats['slope']:.3f} * fast + {stats['intercept']:.3f} (rmse {stats['rmse']:.3f})")
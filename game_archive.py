@@ -0,0 +1,360 @@
+import json
+import operator
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# One value per game, stored as a raw little-endian column file per partition
+SCALAR_COLUMNS = {
+    'game_id': 'S36',
+    'archived_at': '<f8',
+    'mode': 'S8',
+    'num_players': '<i2',
+    'num_turns': '<i2',
+    'final_score': '<i2',
+    'mean_prompt_semantic': '<f4',
+    'mean_prompt_levenshtein': '<f4',
+    'mean_image_similarity': '<f4',
+    'mean_prompt_words': '<f4',
+    'game_seconds': '<f4',
+    'generation_seconds_total': '<f4',
+    'analysis_seconds': '<f4',
+}
+
+# Variable number of values per game: a values file plus an int64 end offset per game.
+# Embeddings are counted in vectors of the given width, prompts are a UTF-8 JSON blob.
+RAGGED_COLUMNS = {
+    'prompt_semantic_scores': ('<f4', 1),
+    'prompt_levenshtein_scores': ('<f4', 1),
+    'image_similarity_scores': ('<f4', 1),
+    'generation_seconds': ('<f4', 1),
+    'prompts': ('u1', 1),
+    'prompt_embeddings': ('<f4', 384),
+    'image_embeddings': ('<f4', 768),
+}
+
+# Min/max are kept per block of rows, so scans can skip blocks as well as whole days
+BLOCK_ROWS = 4096
+
+_OPERATORS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+
+
+def _day_of(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _block_may_match(block, predicates):
+    """False only if the block's min/max prove no row can satisfy every predicate"""
+    for column, op, value in predicates:
+        if column not in block['min']:
+            continue
+        low, high = block['min'][column], block['max'][column]
+        if low is None:
+            # Every value in the block is NaN, which never compares true
+            return op == '!='
+        if op == '==' and not low <= value <= high:
+            return False
+        if op == '<' and not low < value:
+            return False
+        if op == '<=' and not low <= value:
+            return False
+        if op == '>' and not high > value:
+            return False
+        if op == '>=' and not high >= value:
+            return False
+    return True
+
+
+class _Partition:
+    """One day of games: a directory of column files plus _stats.json"""
+
+    def __init__(self, path):
+        self.path = path
+        self._stats_path = os.path.join(path, '_stats.json')
+        if os.path.exists(self._stats_path):
+            with open(self._stats_path) as f:
+                self.stats = json.load(f)
+        else:
+            self.stats = {'rows': 0, 'blocks': []}
+        # End offset of the last committed row of each per-turn column
+        self._ends = {}
+
+    @property
+    def rows(self):
+        return self.stats['rows']
+
+    def _scalar_path(self, column):
+        return os.path.join(self.path, column + '.col')
+
+    def _values_path(self, column):
+        return os.path.join(self.path, column + '.values')
+
+    def _offsets_path(self, column):
+        return os.path.join(self.path, column + '.offsets')
+
+    def _offsets(self, column):
+        if not self.rows:
+            return np.zeros(0, dtype='<i8')
+        return np.memmap(self._offsets_path(column), dtype='<i8', mode='r', shape=(self.rows,))
+
+    def recover(self):
+        """Cut off anything written after the last committed row (an append interrupted by a crash)"""
+        os.makedirs(self.path, exist_ok=True)
+        rows = self.rows
+        for column, dtype in SCALAR_COLUMNS.items():
+            path = self._scalar_path(column)
+            if os.path.exists(path):
+                os.truncate(path, rows * np.dtype(dtype).itemsize)
+        for column, (dtype, width) in RAGGED_COLUMNS.items():
+            offsets_path = self._offsets_path(column)
+            if not os.path.exists(offsets_path):
+                self._ends[column] = 0
+                continue
+            os.truncate(offsets_path, rows * 8)
+            self._ends[column] = int(self._offsets(column)[-1]) if rows else 0
+            os.truncate(self._values_path(column), self._ends[column] * np.dtype(dtype).itemsize * width)
+
+    def append(self, record):
+        """Append one game; the row only becomes visible once _stats.json is replaced"""
+        rows = self.rows
+        for column, dtype in SCALAR_COLUMNS.items():
+            with open(self._scalar_path(column), 'ab') as f:
+                f.write(np.array([record[column]], dtype=dtype).tobytes())
+
+        for column, (dtype, width) in RAGGED_COLUMNS.items():
+            values = np.asarray(record.get(column, ()), dtype=dtype).reshape(-1, width)
+            self._ends[column] += len(values)
+            with open(self._values_path(column), 'ab') as f:
+                f.write(values.tobytes())
+            with open(self._offsets_path(column), 'ab') as f:
+                f.write(np.array([self._ends[column]], dtype='<i8').tobytes())
+
+        blocks = self.stats['blocks']
+        if not blocks or blocks[-1]['rows'] >= BLOCK_ROWS:
+            blocks.append({'rows': 0, 'min': {}, 'max': {}})
+        block = blocks[-1]
+        for column, dtype in SCALAR_COLUMNS.items():
+            if np.dtype(dtype).kind not in 'if':
+                continue
+            value = float(record[column])
+            if np.isnan(value):
+                block['min'].setdefault(column, None)
+                block['max'].setdefault(column, None)
+                continue
+            low, high = block['min'].get(column), block['max'].get(column)
+            block['min'][column] = value if low is None else min(low, value)
+            block['max'][column] = value if high is None else max(high, value)
+        block['rows'] += 1
+        self.stats['rows'] = rows + 1
+
+        temp_path = self._stats_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.stats, f)
+        os.replace(temp_path, self._stats_path)
+
+    def scan(self, columns, predicates):
+        """Read ``columns`` for the rows matching every predicate, touching only the blocks that may match"""
+        # The row count is committed last, so everything below it is complete
+        rows = self.rows
+        if not rows:
+            return None
+
+        candidates = []
+        start = 0
+        for block in list(self.stats['blocks']):
+            if start >= rows:
+                break
+            if _block_may_match(block, predicates):
+                candidates.append(np.arange(start, min(start + block['rows'], rows)))
+            start += block['rows']
+        if not candidates:
+            return None
+        selected = np.concatenate(candidates)
+
+        # Filter on the predicate columns first, then only fetch the survivors' values
+        for column, op, value in predicates:
+            data = np.memmap(self._scalar_path(column), dtype=SCALAR_COLUMNS[column], mode='r', shape=(rows,))
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            selected = selected[_OPERATORS[op](data[selected], value)]
+            if not len(selected):
+                return None
+
+        batch = {}
+        for column in columns:
+            if column in SCALAR_COLUMNS:
+                data = np.memmap(self._scalar_path(column), dtype=SCALAR_COLUMNS[column], mode='r', shape=(rows,))
+                batch[column] = np.array(data[selected])
+                continue
+
+            dtype, width = RAGGED_COLUMNS[column]
+            offsets = self._offsets(column)
+            ends = np.array(offsets[selected])
+            starts = np.where(selected > 0, offsets[np.maximum(selected - 1, 0)], 0)
+            lengths = ends - starts
+            total = int(offsets[-1])
+            values = np.memmap(self._values_path(column), dtype=dtype, mode='r', shape=(total, width)) if total \
+                else np.zeros((0, width), dtype=dtype)
+            # One gather for all selected rows, then split back into per-game arrays
+            gather = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+            parts = np.split(np.array(values[gather]), np.cumsum(lengths)[:-1])
+            if column == 'prompts':
+                batch[column] = [json.loads(part.tobytes().decode('utf-8')) if len(part) else [] for part in parts]
+            else:
+                batch[column] = [part if width > 1 else part.reshape(-1) for part in parts]
+        return batch
+
+
+class GameArchive:
+    """
+    Append-only columnar archive of analyzed games, for offline analytics.
+
+    Games are partitioned by UTC day (``<root>/day=YYYY-MM-DD/``). Inside a
+    partition every per-game value is its own fixed-width column file and every
+    per-turn list is a values file plus an offsets file, so readers memory-map
+    just the columns they ask for. _stats.json holds the committed row count and
+    min/max of the numeric columns per BLOCK_ROWS rows; scans prune on the day
+    range and those zone maps before evaluating predicates, and only gather the
+    requested columns for rows that passed. One process writes a root at a time.
+    """
+
+    def __init__(self, root, keep_embeddings=False):
+        self.root = root
+        self.keep_embeddings = keep_embeddings
+        self._lock = threading.Lock()
+        self._partitions = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _partition(self, day):
+        partition = self._partitions.get(day)
+        if partition is None:
+            partition = _Partition(os.path.join(self.root, f'day={day}'))
+            partition.recover()
+            self._partitions[day] = partition
+        return partition
+
+    def append(self, game_id, game, analysis, analysis_seconds=None, prompt_embeddings=(), image_embeddings=()):
+        """Archive one analyzed game and return the day partition it went to"""
+        now = time.time()
+        prompts = [p['prompt'] for p in game['prompts']]
+        generation_seconds = game.get('generationSeconds', [])
+        created_at, completed_at = game.get('createdAt'), game.get('completedAt')
+
+        record = {
+            'game_id': game_id,
+            'archived_at': now,
+            'mode': analysis['mode'],
+            'num_players': game['numPlayers'],
+            'num_turns': len(prompts),
+            'final_score': analysis['final_score'],
+            'mean_prompt_semantic': np.mean(analysis['prompt_semantic_scores']),
+            'mean_prompt_levenshtein': np.mean(analysis['prompt_levenshtein_scores']),
+            'mean_image_similarity': np.mean(analysis['image_similarity_scores']),
+            'mean_prompt_words': np.mean([len(p.split()) for p in prompts]) if prompts else np.nan,
+            'game_seconds': completed_at - created_at if created_at and completed_at else np.nan,
+            'generation_seconds_total': sum(generation_seconds) if generation_seconds else np.nan,
+            'analysis_seconds': np.nan if analysis_seconds is None else analysis_seconds,
+            'prompt_semantic_scores': analysis['prompt_semantic_scores'],
+            'prompt_levenshtein_scores': analysis['prompt_levenshtein_scores'],
+            'image_similarity_scores': analysis['image_similarity_scores'],
+            'generation_seconds': generation_seconds,
+            'prompts': np.frombuffer(json.dumps(game['prompts']).encode('utf-8'), dtype='u1'),
+        }
+        if self.keep_embeddings:
+            record['prompt_embeddings'] = prompt_embeddings
+            record['image_embeddings'] = image_embeddings
+
+        day = _day_of(now)
+        with self._lock:
+            self._partition(day).append(record)
+        return day
+
+    def days(self, start=None, end=None):
+        """Partition days present on disk, optionally limited to start <= day <= end (YYYY-MM-DD)"""
+        days = sorted(name[len('day='):] for name in os.listdir(self.root) if name.startswith('day='))
+        return [day for day in days if (start is None or day >= start) and (end is None or day <= end)]
+
+    def scan(self, columns=None, where=(), start=None, end=None):
+        """
+        Yield (day, batch) for every partition with matching rows. ``where`` is
+        a list of (column, op, value) on scalar columns, op one of == != < <= > >=,
+        all of which must hold. A batch maps each column to a numpy array
+        (scalar columns) or a list with one entry per game (per-turn columns).
+        """
+        columns = list(columns or SCALAR_COLUMNS)
+        for column in columns:
+            if column not in SCALAR_COLUMNS and column not in RAGGED_COLUMNS:
+                raise ValueError(f'Unknown column: {column}')
+        for column, op, _ in where:
+            if column not in SCALAR_COLUMNS or op not in _OPERATORS:
+                raise ValueError(f'Unsupported predicate: {column} {op}')
+
+        for day in self.days(start, end):
+            with self._lock:
+                partition = self._partitions.get(day) or _Partition(os.path.join(self.root, f'day={day}'))
+            batch = partition.scan(columns, where)
+            if batch is not None:
+                yield day, batch
+
+    def read(self, columns=None, where=(), start=None, end=None):
+        """Like scan, with all partitions concatenated into one batch"""
+        columns = list(columns or SCALAR_COLUMNS)
+        merged = {column: [] for column in columns}
+        for _, batch in self.scan(columns, where, start, end):
+            for column in columns:
+                merged[column].append(batch[column])
+        return {
+            column: np.concatenate(parts) if column in SCALAR_COLUMNS and parts
+            else np.zeros(0, dtype=SCALAR_COLUMNS[column]) if column in SCALAR_COLUMNS
+            else [item for part in parts for item in part]
+            for column, parts in merged.items()
+        }
+
+
+def _parse_predicate(text):
+    for op in ('>=', '<=', '!=', '==', '>', '<'):
+        if op in text:
+            column, value = text.split(op, 1)
+            column, value = column.strip(), value.strip()
+            if np.dtype(SCALAR_COLUMNS.get(column, 'S1')).kind in 'if':
+                value = float(value)
+            return column, op, value
+    raise ValueError(f'Cannot parse predicate: {text}')
+
+
+if __name__ == '__main__':
+    # Summary of archived games, e.g.
+    #   python game_archive.py archive --from 2026-10-01 --where "final_score>=200" --where "mode==accurate"
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize archived games')
+    parser.add_argument('root')
+    parser.add_argument('--from', dest='start')
+    parser.add_argument('--to', dest='end')
+    parser.add_argument('--where', action='append', default=[])
+    args = parser.parse_args()
+
+    archive = GameArchive(args.root)
+    numeric = [c for c, dtype in SCALAR_COLUMNS.items() if np.dtype(dtype).kind in 'if' and c != 'archived_at']
+    data = archive.read(numeric, [_parse_predicate(p) for p in args.where], args.start, args.end)
+
+    games = len(data['final_score'])
+    print(f'{games} games')
+    if not games:
+        sys.exit(0)
+    print(f"{'column':<26}{'mean':>10}{'p50':>10}{'p90':>10}{'min':>10}{'max':>10}")
+    for column in numeric:
+        values = data[column].astype(np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            continue
+        p50, p90 = np.percentile(values, [50, 90])
+        print(f'{column:<26}{values.mean():>10.2f}{p50:>10.2f}{p90:>10.2f}{values.min():>10.2f}{values.max():>10.2f}')
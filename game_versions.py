@@ -0,0 +1,67 @@
+import threading
+
+
+class _Clock:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = 0
+        self.discarded = False
+
+
+class GameVersions:
+    """
+    Per-game change counters that requests can block on.
+
+    Every mutation of a game bumps its version and wakes the requests waiting
+    on that game's condition variable, so a long-poll costs nothing while the
+    game is idle and returns as soon as something changes. Versions survive a
+    reset (the game dict is replaced, the counter is not), so an ETag built
+    from one is never reused for different state.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clocks = {}
+
+    def _clock(self, game_id):
+        with self._lock:
+            clock = self._clocks.get(game_id)
+            if clock is None:
+                clock = self._clocks[game_id] = _Clock()
+            return clock
+
+    def current(self, game_id):
+        return self._clock(game_id).version
+
+    def bump(self, game_id):
+        clock = self._clock(game_id)
+        with clock.cond:
+            clock.version += 1
+            clock.cond.notify_all()
+            return clock.version
+
+    def advance_to(self, game_id, version):
+        """Continue from a version seen elsewhere (a game moved in from another shard)"""
+        clock = self._clock(game_id)
+        with clock.cond:
+            clock.version = max(clock.version, version) + 1
+            clock.cond.notify_all()
+            return clock.version
+
+    def wait_for(self, game_id, version, timeout):
+        """
+        Block until the game reaches ``version`` or is discarded, at most
+        ``timeout`` seconds. Returns the version the game is at.
+        """
+        clock = self._clock(game_id)
+        with clock.cond:
+            clock.cond.wait_for(lambda: clock.version >= version or clock.discarded, timeout)
+            return clock.version
+
+    def discard(self, game_id):
+        with self._lock:
+            clock = self._clocks.pop(game_id, None)
+        if clock is not None:
+            with clock.cond:
+                clock.discarded = True
+                clock.cond.notify_all()
@@ -0,0 +1,128 @@
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class GenerationQueueFull(Exception):
+    """Raised when a generation can't be admitted; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Generation queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, game_id, remaining_turns, seq):
+        self.game_id = game_id
+        self.remaining_turns = remaining_turns
+        self.seq = seq
+        self.admitted = False
+
+
+class GenerationScheduler:
+    """
+    Admission control for outbound image generations.
+
+    At most ``max_concurrent`` generations run at once. Everything else waits in
+    per-game FIFO queues; when a slot frees up the next turn comes from the game
+    with the fewest remaining turns, and among those the game that was served
+    least recently, so one busy game can't starve the others. Once
+    ``max_queue`` turns are waiting new ones are rejected straight away with a
+    retry estimate based on the observed generation times.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=32, max_wait=120, initial_service_time=15.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._queues = {}
+        self._last_served = {}
+        self._seq = itertools.count()
+        # Exponentially weighted average of generation durations
+        self._service_time = initial_service_time
+
+    def _retry_after_locked(self):
+        # Expected time until everything ahead of a new arrival has started
+        rounds = (self._waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self._service_time))
+
+    def _dispatch_locked(self):
+        while self._active < self.max_concurrent and self._waiting:
+            game_id = min(
+                (game_id for game_id, queue in self._queues.items() if queue),
+                key=lambda g: (self._queues[g][0].remaining_turns, self._last_served.get(g, -1), self._queues[g][0].seq)
+            )
+            ticket = self._queues[game_id].popleft()
+            if not self._queues[game_id]:
+                del self._queues[game_id]
+            self._waiting -= 1
+            self._admit_locked(ticket)
+        self._cond.notify_all()
+
+    def _admit_locked(self, ticket):
+        ticket.admitted = True
+        self._active += 1
+        self._last_served[ticket.game_id] = ticket.seq
+
+    def acquire(self, game_id, remaining_turns=0, timeout=None):
+        with self._cond:
+            ticket = _Ticket(game_id, remaining_turns, next(self._seq))
+
+            if self._active < self.max_concurrent and not self._waiting:
+                self._admit_locked(ticket)
+                return ticket
+
+            if self._waiting >= self.max_queue:
+                raise GenerationQueueFull(self._retry_after_locked())
+
+            self._queues.setdefault(game_id, deque()).append(ticket)
+            self._waiting += 1
+
+            max_wait = self.max_wait if timeout is None else min(timeout, self.max_wait)
+            deadline = time.monotonic() + max_wait
+            while not ticket.admitted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queues[game_id].remove(ticket)
+                    if not self._queues[game_id]:
+                        del self._queues[game_id]
+                    self._waiting -= 1
+                    raise GenerationQueueFull(self._retry_after_locked())
+                self._cond.wait(remaining)
+            return ticket
+
+    def release(self, ticket, duration=None):
+        with self._cond:
+            self._active -= 1
+            if duration is not None:
+                self._service_time = 0.8 * self._service_time + 0.2 * duration
+            # Keep the fairness bookkeeping bounded
+            if len(self._last_served) > 1024:
+                self._last_served = {g: s for g, s in self._last_served.items() if g in self._queues}
+            self._dispatch_locked()
+
+    @contextmanager
+    def slot(self, game_id, remaining_turns=0, timeout=None):
+        """Hold a generation slot for the duration of the block"""
+        ticket = self.acquire(game_id, remaining_turns, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(ticket, time.monotonic() - started)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'maxConcurrent': self.max_concurrent,
+                'maxQueue': self.max_queue,
+                'avgServiceTime': round(self._service_time, 2)
+            }
@@ -0,0 +1,258 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+CHUNK_SIZE = 64 * 1024
+# Puts and deletes of one key are serialized on one of this many striped locks
+KEY_LOCK_STRIPES = 64
+
+
+def shard_path(root, key):
+    """blobs are spread over 256 * 256 directories: <root>/ab/cd/abcd..."""
+    return os.path.join(root, key[:2], key[2:4], key)
+
+
+class LocalBackend:
+    """Blobs stored as files in a sharded directory tree"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(root, exist_ok=True)
+
+    def exists(self, key):
+        return os.path.exists(shard_path(self.root, key))
+
+    def put_file(self, key, temp_path):
+        """Move a finished temp file into place (the temp file is consumed)"""
+        path = shard_path(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(shard_path(self.root, key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        return shard_path(self.root, key)
+
+    def serve(self, key):
+        """Return ('path', path) to send directly from disk"""
+        return 'path', shard_path(self.root, key)
+
+
+class InMemoryS3Client:
+    """
+    Stand-in for a boto3 S3 client that keeps objects in a dict, with just the
+    calls S3Backend makes, so the S3 code path can be exercised without a bucket.
+    """
+
+    class NoSuchKey(Exception):
+        pass
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        data = Body if isinstance(Body, bytes) else Body.read()
+        with self._lock:
+            self.objects[(Bucket, Key)] = data
+        return {'ETag': hashlib.md5(data).hexdigest()}
+
+    def _get(self, Bucket, Key):
+        with self._lock:
+            try:
+                return self.objects[(Bucket, Key)]
+            except KeyError:
+                raise self.NoSuchKey(f'{Bucket}/{Key}') from None
+
+    def get_object(self, Bucket, Key):
+        data = self._get(Bucket, Key)
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self._get(Bucket, Key))}
+
+    def delete_object(self, Bucket, Key):
+        # Like S3, deleting a missing key is not an error
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return f"memory://{Params['Bucket']}/{Params['Key']}?method={ClientMethod}&expires={ExpiresIn}"
+
+
+class S3Backend:
+    """
+    Blobs stored as objects in an S3-compatible bucket.
+
+    ``client`` is a boto3 S3 client (or anything with the same put/get/head/
+    delete calls), so a local MinIO endpoint or an InMemoryS3Client can stand
+    in for S3. Reads for analysis go through a local cache, which never needs
+    invalidating because keys are content hashes.
+    """
+
+    def __init__(self, client, bucket, cache_root, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.cache_root = os.path.abspath(cache_root)
+        self.prefix = prefix
+        os.makedirs(cache_root, exist_ok=True)
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key[:2]}/{key[2:4]}/{key}"
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception:
+            return False
+
+    def put_file(self, key, temp_path):
+        with open(temp_path, 'rb') as f:
+            self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=f)
+        # Keep the bytes we already have as the local cache copy
+        cached = shard_path(self.cache_root, key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        os.replace(temp_path, cached)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        try:
+            os.remove(shard_path(self.cache_root, key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        cached = shard_path(self.cache_root, key)
+        if not os.path.exists(cached):
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            body = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body']
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cached))
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(body, f, CHUNK_SIZE)
+            os.replace(temp_path, cached)
+        return cached
+
+    def serve(self, key):
+        """Return ('url', presigned_url) so clients fetch straight from the bucket"""
+        url = self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self._object_key(key)},
+            ExpiresIn=3600
+        )
+        return 'url', url
+
+
+class ImageStore:
+    """
+    Content-addressed image storage with reference counting.
+
+    Images are keyed by the SHA-256 of their bytes, so identical uploads are
+    stored once. Each game that points at a blob holds a reference; the blob is
+    deleted when the last reference is released.
+
+    The refcount lock only guards the counts. Backend writes and deletes (which
+    may be S3 round trips) run under a per-key striped lock, so a second put
+    of the same content waits for the first to land, and a slow delete doesn't
+    hold up other keys.
+    """
+
+    def __init__(self, backend, temp_dir):
+        self.backend = backend
+        self.temp_dir = temp_dir
+        os.makedirs(temp_dir, exist_ok=True)
+        self._refcounts = {}
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(KEY_LOCK_STRIPES)]
+
+    def _key_lock(self, key):
+        return self._key_locks[int(key[:8], 16) % KEY_LOCK_STRIPES]
+
+    def put_stream(self, stream):
+        """Store the contents of a file-like object and return its key (with a reference held)"""
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+            return self.put_temp_file(temp_path, digest.hexdigest())
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def put_bytes(self, data):
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self.put_temp_file(temp_path, hashlib.sha256(data).hexdigest())
+
+    def put_temp_file(self, temp_path, key):
+        """Adopt a temp file whose hash is already known (the temp file is consumed)"""
+        # Holding the key lock, a concurrent put of the same key waits until the blob
+        # is in place and a concurrent release can't delete it under us
+        with self._key_lock(key):
+            with self._lock:
+                first_reference = key not in self._refcounts
+                self._refcounts[key] = self._refcounts.get(key, 0) + 1
+
+            try:
+                if first_reference and not self.backend.exists(key):
+                    self.backend.put_file(key, temp_path)
+                    return key
+            except Exception:
+                with self._lock:
+                    count = self._refcounts.pop(key) - 1
+                    if count > 0:
+                        self._refcounts[key] = count
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        os.remove(temp_path)
+        return key
+
+    def retain(self, key):
+        with self._lock:
+            self._refcounts[key] = self._refcounts.get(key, 0) + 1
+
+    def release(self, key):
+        with self._key_lock(key):
+            with self._lock:
+                count = self._refcounts.get(key, 0) - 1
+                if count > 0:
+                    self._refcounts[key] = count
+                    return
+                self._refcounts.pop(key, None)
+            self.backend.delete(key)
+
+    def local_path(self, key):
+        """A path on local disk for code that needs a real file (PIL, model preprocessing)"""
+        return self.backend.local_path(key)
+
+    def serve(self, key):
+        return self.backend.serve(key)
+
+
+def create_image_store(root):
+    """Build the store configured by IMAGE_STORE_BACKEND (local by default, or s3)"""
+    backend_name = os.getenv('IMAGE_STORE_BACKEND', 'local')
+    if backend_name == 's3':
+        import boto3  # Only needed for the S3 backend
+
+        client = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT_URL') or None)
+        backend = S3Backend(client, os.environ['S3_BUCKET'], os.path.join(root, 'cache'), os.getenv('S3_PREFIX', ''))
+    else:
+        backend = LocalBackend(os.path.join(root, 'blobs'))
+    return ImageStore(backend, os.path.join(root, 'tmp'))
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+
+# final_score is the sum of three components that are each normalized to [0, 1]
+# and scaled by 100 (see analyze_game_results), so every score is an int in [0, 300]
+MIN_SCORE = 0
+MAX_SCORE = 300
+
+
+class Leaderboard:
+    """
+    Global leaderboard of final game scores.
+
+    Scores are bounded integers, so instead of a general balanced tree we keep a
+    Fenwick (binary indexed) tree of counts over the score range plus one bucket
+    of game ids per score. That gives O(log n) insert/remove and rank lookups,
+    and top-K only touches the K best entries (plus empty score slots).
+
+    With a ``path`` every record and remove is appended to a JSON-lines journal
+    there and replayed on startup, so the board survives restarts. The journal
+    is rewritten with just the live entries when it has grown well past them.
+    """
+
+    def __init__(self, min_score=MIN_SCORE, max_score=MAX_SCORE, path=None):
+        self.min_score = min_score
+        self.max_score = max_score
+        self._size = max_score - min_score + 1
+        self._tree = [0] * (self._size + 1)
+        # score slot -> {game_id: entry}, dicts keep insertion order so ties rank by who scored first
+        self._buckets = [dict() for _ in range(self._size)]
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.path = path
+        self._journal = None
+        if path is not None:
+            self._load()
+            self._journal = open(path, 'a')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        with open(self.path) as f:
+            for line in f:
+                lines += 1
+                record = json.loads(line)
+                if 'removed' in record:
+                    self._remove_locked(record['removed'])
+                else:
+                    self._record_locked(record['gameId'], record['final_score'], record['breakdown'])
+
+        if lines > 2 * len(self._entries) + 1000:
+            # _entries is in insertion order, so ties still rank by who scored first
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as f:
+                for game_id in self._entries:
+                    entry = self._buckets[self._entries[game_id]][game_id]
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(temp_path, self.path)
+
+    def _log(self, record):
+        if self._journal is not None:
+            # Breakdowns can hold numpy floats from the scoring code
+            self._journal.write(json.dumps(record, default=float) + '\n')
+            self._journal.flush()
+
+    def _slot(self, score):
+        score = int(round(score))
+        score = max(self.min_score, min(self.max_score, score))
+        return score - self.min_score
+
+    def _update(self, slot, delta):
+        i = slot + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _count_at_or_below(self, slot):
+        i = slot + 1
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def record(self, game_id, final_score, breakdown=None):
+        """Insert or replace the score for a game"""
+        with self._lock:
+            entry = self._record_locked(game_id, final_score, breakdown)
+            self._log(entry)
+            return entry
+
+    def _record_locked(self, game_id, final_score, breakdown):
+        if game_id in self._entries:
+            self._remove_locked(game_id)
+
+        slot = self._slot(final_score)
+        entry = {
+            'gameId': game_id,
+            'final_score': int(final_score),
+            'breakdown': breakdown or {}
+        }
+        self._buckets[slot][game_id] = entry
+        self._entries[game_id] = slot
+        self._update(slot, 1)
+        return entry
+
+    def remove(self, game_id):
+        with self._lock:
+            removed = self._remove_locked(game_id)
+            if removed:
+                self._log({'removed': game_id})
+            return removed
+
+    def _remove_locked(self, game_id):
+        slot = self._entries.pop(game_id, None)
+        if slot is None:
+            return False
+        del self._buckets[slot][game_id]
+        self._update(slot, -1)
+        return True
+
+    def top(self, k=10):
+        """Return the k best entries, highest score first"""
+        results = []
+        with self._lock:
+            rank = 1
+            for slot in range(self._size - 1, -1, -1):
+                if len(results) >= k:
+                    break
+                bucket = self._buckets[slot]
+                if not bucket:
+                    continue
+                for entry in bucket.values():
+                    if len(results) >= k:
+                        break
+                    results.append(dict(entry, rank=rank))
+                # Tied scores share a rank
+                rank += len(bucket)
+        return results
+
+    def rank(self, game_id):
+        """
+        Return rank and percentile for a game, or None if it has no score.
+
+        Rank is 1-based with ties sharing the best rank. Percentile is the share
+        of games that scored strictly lower, plus half of the ties.
+        """
+        with self._lock:
+            slot = self._entries.get(game_id)
+            if slot is None:
+                return None
+
+            total = len(self._entries)
+            at_or_below = self._count_at_or_below(slot)
+            below = self._count_at_or_below(slot - 1) if slot > 0 else 0
+            ties = at_or_below - below
+            entry = self._buckets[slot][game_id]
+
+            return {
+                'gameId': game_id,
+                'final_score': entry['final_score'],
+                'breakdown': entry['breakdown'],
+                'rank': total - at_or_below + 1,
+                'totalGames': total,
+                'percentile': round(100.0 * (below + 0.5 * ties) / total, 2)
+            }
+
+    def counts(self, score):
+        """How many games scored below / at or below a score (for merging ranks across shards)"""
+        slot = self._slot(score)
+        with self._lock:
+            return {
+                'below': self._count_at_or_below(slot - 1) if slot > 0 else 0,
+                'atOrBelow': self._count_at_or_below(slot),
+                'total': len(self._entries)
+            }
+
+    def __len__(self):
+        return len(self._entries)
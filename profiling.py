@@ -0,0 +1,199 @@
+import cProfile
+import hashlib
+import hmac
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from xml.sax.saxutils import escape
+
+
+def _frame_label(code, cache):
+    label = cache.get(code)
+    if label is None:
+        # Last two path parts are enough to tell torch/PIL/flask/app code apart
+        path = os.path.normpath(code.co_filename).split(os.sep)
+        # ';' separates frames in the collapsed format
+        label = f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})".replace(';', ':')
+        cache[code] = label
+    return label
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler over every thread in the process.
+
+    The capturing thread wakes up every ``interval`` seconds and records the
+    current stack of every other thread via sys._current_frames(), so the
+    profiled code runs unmodified and the cost is one stack walk per thread per
+    sample. Only one capture runs at a time.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def busy(self):
+        return self._lock.locked()
+
+    def run(self, seconds):
+        """
+        Sample for ``seconds`` and return (Counter of collapsed stacks, number
+        of samples), or None if another capture is already running.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            stacks = Counter()
+            labels = {}
+            samples = 0
+            own_ident = threading.get_ident()
+            deadline = time.monotonic() + seconds
+
+            while time.monotonic() < deadline:
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        frames.append(_frame_label(frame.f_code, labels))
+                        frame = frame.f_back
+                    frames.append(thread_names.get(ident, f'thread-{ident}').replace(';', ':'))
+                    stacks[';'.join(reversed(frames))] += 1
+                samples += 1
+                time.sleep(self.interval)
+            return stacks, samples
+        finally:
+            self._lock.release()
+
+
+def collapse_stacks(stacks):
+    """Brendan Gregg's collapsed format, one 'root;...;leaf count' line per stack"""
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+def _frame_color(label):
+    # Stable warm colours so the same function looks the same across captures
+    h = hashlib.md5(label.encode('utf-8')).digest()
+    return f'rgb({205 + h[0] % 50},{80 + h[1] % 130},{h[2] % 60})'
+
+
+def render_flame_graph(stacks, title='Flame graph', width=1200, frame_height=16, min_width=0.5):
+    """Render collapsed stacks as a self-contained SVG flame graph (roots at the bottom)"""
+    root = {'count': 0, 'children': {}}
+    for stack, count in stacks.items():
+        root['count'] += count
+        node = root
+        for label in stack.split(';'):
+            node = node['children'].setdefault(label, {'count': 0, 'children': {}})
+            node['count'] += count
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node['children'].values()), default=0)
+
+    levels = depth(root) - 1
+    top = 2 * frame_height
+    height = top + (levels + 1) * frame_height
+    total = root['count'] or 1
+    scale = (width - 20) / total
+
+    rects = []
+
+    def draw(node, x, level):
+        for label, child in sorted(node['children'].items()):
+            w = child['count'] * scale
+            if w >= min_width:
+                y = height - (level + 1) * frame_height
+                share = 100.0 * child['count'] / total
+                # Roughly 7px per monospace character, drop the label when it won't fit
+                text = escape(label[:int(w / 7)]) if w > 40 else ''
+                rects.append(
+                    f'<g><title>{escape(label)} ({child["count"]} samples, {share:.2f}%)</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{frame_height - 1}" fill="{_frame_color(label)}" rx="2"/>'
+                    f'<text x="{x + 3:.1f}" y="{y + frame_height - 4}" font-size="11" font-family="monospace">{text}</text></g>'
+                )
+                draw(child, x, level + 1)
+            x += w
+
+    draw(root, 10.0, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+        f'<rect width="100%" height="100%" fill="#f8f8f8"/>'
+        f'<text x="{width / 2}" y="{frame_height + 2}" font-size="14" font-family="sans-serif" text-anchor="middle">'
+        f'{escape(title)}</text>'
+        + ''.join(rects) +
+        '</svg>'
+    )
+
+
+def check_profiling_token(request, token):
+    """True if profiling is enabled (a token is configured) and the request carries it"""
+    supplied = request.headers.get('X-Profile-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8'))
+
+
+def init_request_profiling(app, token, limit=40):
+    """
+    Per-request cProfile: a request sent with ``X-Profile: 1`` and the profiling
+    token is run under cProfile, and the top ``limit`` functions by cumulative
+    time are added to a JSON response as ``profile`` (other responses get them
+    in an X-Profile-Stats header, one line per function).
+    """
+    from flask import g, request
+
+    # cProfile hooks the interpreter for the calling thread only, but newer
+    # Pythons allow just one active profiler, so profile one request at a time
+    profile_lock = threading.Lock()
+
+    @app.before_request
+    def start_request_profile():
+        if request.headers.get('X-Profile') not in ('1', 'true') or not check_profiling_token(request, token):
+            return
+        if not profile_lock.acquire(blocking=False):
+            g.request_profile_skipped = True
+            return
+        g.request_profile = cProfile.Profile()
+        g.request_profile.enable()
+
+    @app.after_request
+    def attach_request_profile(response):
+        if g.get('request_profile_skipped'):
+            response.headers['X-Profile-Skipped'] = 'another request is being profiled'
+            return response
+
+        profile = g.pop('request_profile', None)
+        if profile is None:
+            return response
+        profile.disable()
+        profile_lock.release()
+
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output)
+        stats.sort_stats('cumulative').print_stats(limit)
+
+        if response.is_json and not response.is_streamed:
+            body = response.get_json()
+            if isinstance(body, dict):
+                body['profile'] = {
+                    'totalCalls': stats.total_calls,
+                    'totalSeconds': round(stats.total_tt, 6),
+                    'stats': output.getvalue()
+                }
+                response.set_data(app.json.dumps(body))
+                return response
+        response.headers['X-Profile-Stats'] = ' | '.join(
+            line.strip() for line in output.getvalue().splitlines() if line.strip()
+        )[:8000]
+        return response
+
+    @app.teardown_request
+    def stop_request_profile(error=None):
+        # after_request doesn't run when the view raised
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            profile.disable()
+            profile_lock.release()
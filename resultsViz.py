@@ -6,42 +6,44 @@ from transformers import ViTFeatureExtractor, ViTModel
 from PIL import Image
 import matplotlib.pyplot as plt
 import numpy as np
+import logging
 
-def simScoreImage(image1, image2):
+logger = logging.getLogger(__name__)
+
+def embedImage(image):
     # Load pretrained ViT and feature extractor
     model = ViTModel.from_pretrained("google/vit-base-patch16-224-in21k")
     feature_extractor = ViTFeatureExtractor.from_pretrained("google/vit-base-patch16-224-in21k")
     model.eval()
 
-    # Load and preprocess two images
-    # image paths 
-    image1 = Image.open(image1).convert("RGB")
-    image2 = Image.open(image2).convert("RGB")
-
-    inputs1 = feature_extractor(images=image1, return_tensors="pt")
-    inputs2 = feature_extractor(images=image2, return_tensors="pt")
+    # Load and preprocess the image from its path
+    image = Image.open(image).convert("RGB")
+    inputs = feature_extractor(images=image, return_tensors="pt")
 
-    # Get embeddings (use CLS token output)
+    # Get embedding (use CLS token output)
     with torch.no_grad():
-        output1 = model(**inputs1).last_hidden_state[:, 0]
-        output2 = model(**inputs2).last_hidden_state[:, 0]
+        return model(**inputs).last_hidden_state[:, 0]
+
+def simScoreImage(image1, image2):
+    output1 = embedImage(image1)
+    output2 = embedImage(image2)
 
     cosine_sim = F.cosine_similarity(output1, output2, dim=1).item()
-    print("cosine similarity")
-    print(cosine_sim)
+    logger.debug("Image cosine similarity: %s", cosine_sim)
 
     return cosine_sim
 
-def simScore(prompt1, prompt2):
+def embedPrompt(prompt):
     model = SentenceTransformer('all-MiniLM-L6-v2')
-    emb1 = model.encode(prompt1, convert_to_tensor=True)
-    emb2 = model.encode(prompt2, convert_to_tensor=True)
+    return model.encode(prompt, convert_to_tensor=True)
+
+def simScore(prompt1, prompt2):
+    emb1 = embedPrompt(prompt1)
+    emb2 = embedPrompt(prompt2)
 
     # Cosine similarity
     cosine_sim = F.cosine_similarity(emb1, emb2, dim=0)
-    print("Semantic similarity:", cosine_sim.item())
-    print("cosine similarity")
-    print(cosine_sim)
+    logger.debug("Semantic similarity: %s", cosine_sim.item())
     return cosine_sim.item()
 
 def levScore(prompt1, prompt2):
@@ -65,26 +67,37 @@ def main(reference_prompt, example_prompts, reference_image, example_images):
     prompt_levenshtein_scores = []
     image_similarity_scores = []
     
+    # Embeddings are kept so callers can index them for similarity search
+    prompt_embeddings = []
+    image_embeddings = []
+    
     # Compute similarities between reference prompt and each example prompt
-    print("Computing prompt similarities against reference...")
+    logger.debug("Computing prompt similarities against reference")
+    reference_prompt_emb = embedPrompt(reference_prompt)
     for i, example_prompt in enumerate(example_prompts):
-        print(f"Comparing reference prompt with example prompt {i+1}")
+        logger.debug("Comparing reference prompt with example prompt %d", i + 1)
         
         # Semantic similarity
-        sem_sim = simScore(reference_prompt, example_prompt)
+        example_prompt_emb = embedPrompt(example_prompt)
+        sem_sim = F.cosine_similarity(reference_prompt_emb, example_prompt_emb, dim=0).item()
         prompt_semantic_scores.append(sem_sim)
+        prompt_embeddings.append(example_prompt_emb.cpu().numpy())
         
         # Levenshtein distance
         lev_dist = levScore(reference_prompt, example_prompt)
         prompt_levenshtein_scores.append(lev_dist)
     
     # Compute similarities between reference image and each example image
-    print("\nComputing image similarities against reference...")
+    logger.debug("Computing image similarities against reference")
+    reference_image_emb = embedImage(reference_image)
+    image_embeddings.append(reference_image_emb[0].numpy())
     for i, example_image in enumerate(example_images):
-        print(f"Comparing reference image with example image {i+1}")
+        logger.debug("Comparing reference image with example image %d", i + 1)
         
-        img_sim = simScoreImage(reference_image, example_image)
+        example_image_emb = embedImage(example_image)
+        img_sim = F.cosine_similarity(reference_image_emb, example_image_emb, dim=1).item()
         image_similarity_scores.append(img_sim)
+        image_embeddings.append(example_image_emb[0].numpy())
     
     # Set up plotting style
     plt.style.use('default')
@@ -111,10 +124,7 @@ def main(reference_prompt, example_prompts, reference_image, example_images):
     # Create consistent x-axis for all plots
     x_axis = list(range(1, max_length + 1))
     
-    print(f"Plotting with {max_length} users for all charts")
-    print(f"Prompt semantic scores: {len(prompt_semantic_scores)}")
-    print(f"Prompt levenshtein scores: {len(prompt_levenshtein_scores)}")
-    print(f"Image similarity scores: {len(image_similarity_scores)}")
+    logger.debug("Plotting with %d users for all charts", max_length)
     
     # Plot 1: Reference vs Example Prompts Semantic Similarity
     plt.figure(figsize=(10, 6))
@@ -221,7 +231,7 @@ def main(reference_prompt, example_prompts, reference_image, example_images):
 
     score = mean_lev * 100 + normalized_sim_prompt * 100 + normalized_sim_image * 100
 
-    print(f"FINAL SCORE: {int(score)}")
+    logger.info("FINAL SCORE: %d", int(score))
 
 
     return {
@@ -229,13 +239,16 @@ def main(reference_prompt, example_prompts, reference_image, example_images):
         'reference_image': reference_image,
         'prompt_semantic_scores': prompt_semantic_scores,
         'prompt_levenshtein_scores': prompt_levenshtein_scores,
-        'image_similarity_scores': image_similarity_scores
+        'image_similarity_scores': image_similarity_scores,
+        'prompt_embeddings': prompt_embeddings,
+        'image_embeddings': image_embeddings
     }
 
     print()
 
 # Example usage:
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     # Example reference and example data (replace with your actual data)
 
     # change this to the original first prompt
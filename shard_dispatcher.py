@@ -0,0 +1,510 @@
+import argparse
+import bisect
+import hashlib
+import hmac
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+from flask import Flask, Response, jsonify, request
+from flask_cors import CORS
+
+from profiling import check_profiling_token
+from structured_logging import setup_logging
+
+logger = logging.getLogger('shard_dispatcher')
+
+# Hop-by-hop headers that must not be forwarded by a proxy
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+               'te', 'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length'}
+
+
+class _SizedStream:
+    """Request body with a known length, so requests sends Content-Length instead of chunking"""
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
+def _ring_position(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping game ids to shards.
+
+    Every shard owns ``vnodes`` points on the ring so load evens out; adding a
+    shard only takes over the ids between its points and their predecessors,
+    roughly 1/N of the games, everything else stays where it was.
+    """
+
+    def __init__(self, nodes=(), vnodes=100):
+        self.vnodes = vnodes
+        # (positions, owners), replaced as a whole so lookups without a lock never see half an update
+        self._ring = ([], [])
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        positions, owners = list(self._ring[0]), list(self._ring[1])
+        for i in range(self.vnodes):
+            position = _ring_position(f'{node}#{i}')
+            index = bisect.bisect(positions, position)
+            positions.insert(index, position)
+            owners.insert(index, node)
+        self._ring = (positions, owners)
+
+    def lookup(self, key):
+        positions, owners = self._ring
+        if not positions:
+            raise LookupError('Hash ring has no shards')
+        index = bisect.bisect(positions, _ring_position(key)) % len(positions)
+        return owners[index]
+
+
+class Shard:
+    """One app.py worker process with its own game state and data folders"""
+
+    def __init__(self, shard_id, port, data_root, host='127.0.0.1'):
+        self.shard_id = shard_id
+        self.url = f'http://{host}:{port}'
+        self.port = port
+        self.data_root = os.path.join(data_root, str(shard_id))
+        self.process = None
+        # Games that are not completed yet, refreshed from the worker
+        self.active_games = 0
+
+    def start(self, extra_env=None):
+        env = dict(os.environ, **(extra_env or {}))
+        env.update(SHARD_WORKER='1',
+                   FLASK_HOST='127.0.0.1',
+                   FLASK_PORT=str(self.port),
+                   FLASK_DEBUG='False',
+                   STORE_FOLDER=os.path.join(self.data_root, 'store'),
+                   INDEX_FOLDER=os.path.join(self.data_root, 'index'),
+                   ARCHIVE_FOLDER=os.path.join(self.data_root, 'archive'),
+                   # Image refcounts live in each worker, so with IMAGE_STORE_BACKEND=s3 every
+                   # worker needs its own objects: a shard dropping its last reference to a
+                   # hash must not delete an object that games on another shard still use
+                   S3_PREFIX=f"{env.get('S3_PREFIX', '')}shard-{self.shard_id}/")
+        app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+        self.process = subprocess.Popen([sys.executable, app_path], env=env)
+
+    def wait_ready(self, session, timeout=120):
+        # Workers load the ML models at import time, so give them a while
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                raise RuntimeError(f'Shard {self.shard_id} exited with code {self.process.returncode}')
+            try:
+                if session.get(f'{self.url}/api/health', timeout=2).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f'Shard {self.shard_id} did not become ready in {timeout}s')
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+
+class ShardDispatcher:
+    """
+    Routes game requests to the shard that owns the game id.
+
+    New games go to the shard with the fewest active games: the dispatcher
+    mints uuids until one hashes to that shard, so after creation routing is
+    purely a ring lookup and needs no table of game -> shard.
+    """
+
+    def __init__(self, base_port=5001, data_root='shards', vnodes=100, load_refresh_seconds=5.0):
+        self.base_port = base_port
+        self.data_root = data_root
+        self.load_refresh_seconds = load_refresh_seconds
+        self.session = requests.Session()
+        self.shards = {}
+        self.ring = HashRing(vnodes=vnodes)
+        # Readers hold it shared for a request, rebalancing takes it exclusively
+        self._routing = threading.Condition()
+        self._readers = 0
+        self._rebalancing = False
+        self._loads_refreshed_at = 0.0
+        self._next_shard_id = 0
+        # Per-worker limits handed to every worker, see start()
+        self.worker_env = {}
+
+    # Routing lock
+
+    def _acquire_read(self):
+        with self._routing:
+            while self._rebalancing:
+                self._routing.wait()
+            self._readers += 1
+
+    def _release_read(self):
+        with self._routing:
+            self._readers -= 1
+            self._routing.notify_all()
+
+    def _acquire_write(self):
+        with self._routing:
+            while self._rebalancing:
+                self._routing.wait()
+            self._rebalancing = True
+            while self._readers:
+                self._routing.wait()
+
+    def _release_write(self):
+        with self._routing:
+            self._rebalancing = False
+            self._routing.notify_all()
+
+    # Shards
+
+    def start(self, num_shards):
+        # GENERATION_CONCURRENCY / GENERATION_QUEUE_SIZE are meant for the whole
+        # deployment, but each worker enforces its own, so split them between the
+        # initial workers. Shards added later get the same share, which raises the total.
+        for name, default in (('GENERATION_CONCURRENCY', 4), ('GENERATION_QUEUE_SIZE', 32)):
+            self.worker_env[name] = str(max(1, int(os.getenv(name, default)) // num_shards))
+        new_shards = [self._spawn() for _ in range(num_shards)]
+        for shard in new_shards:
+            shard.wait_ready(self.session)
+            self.shards[shard.shard_id] = shard
+            self.ring.add(shard.shard_id)
+
+    def _spawn(self):
+        shard_id = self._next_shard_id
+        self._next_shard_id += 1
+        shard = Shard(shard_id, self.base_port + shard_id, self.data_root)
+        shard.start(self.worker_env)
+        return shard
+
+    def stop(self):
+        for shard in self.shards.values():
+            shard.stop()
+
+    def shard_for(self, game_id):
+        return self.shards[self.ring.lookup(game_id)]
+
+    def refresh_loads(self, force=False):
+        if not force and time.monotonic() - self._loads_refreshed_at < self.load_refresh_seconds:
+            return
+        for shard in self.shards.values():
+            try:
+                shard.active_games = self.session.get(f'{shard.url}/api/internal/games', timeout=5).json()['activeGames']
+            except (requests.RequestException, ValueError, KeyError):
+                logger.warning('Could not read shard load', extra={'shard': shard.shard_id})
+        self._loads_refreshed_at = time.monotonic()
+
+    def assign_game_id(self):
+        """Pick the least loaded shard and a fresh id that hashes to it"""
+        self.refresh_loads()
+        shard = min(self.shards.values(), key=lambda s: (s.active_games, s.shard_id))
+        while True:
+            game_id = str(uuid.uuid4())
+            if self.ring.lookup(game_id) == shard.shard_id:
+                # Count it now so a burst of creates spreads out before the next refresh
+                shard.active_games += 1
+                return shard, game_id
+
+    def add_shard(self):
+        """
+        Start one more worker and move over only the games the ring now maps
+        to it. Requests wait while games are in flight between shards.
+
+        Games are copied to the new shard first and the ring only switches once
+        every copy landed; if one fails the copies are dropped, the worker is
+        stopped and routing is left as it was.
+        """
+        shard = self._spawn()
+        try:
+            shard.wait_ready(self.session)
+        except RuntimeError:
+            shard.stop()
+            raise
+
+        self._acquire_write()
+        try:
+            ring = HashRing(list(self.shards) + [shard.shard_id], vnodes=self.ring.vnodes)
+            moving = []
+            try:
+                for source in self.shards.values():
+                    game_ids = self.session.get(f'{source.url}/api/internal/games', timeout=10).json()['gameIds']
+                    for game_id in game_ids:
+                        # Skip leftovers of an earlier move whose drop failed, the owner has the live copy
+                        if ring.lookup(game_id) != shard.shard_id or self.ring.lookup(game_id) != source.shard_id:
+                            continue
+                        exported = self.session.get(f'{source.url}/api/internal/games/{game_id}', timeout=30)
+                        exported.raise_for_status()
+                        self.session.put(f'{shard.url}/api/internal/games/{game_id}',
+                                         json=exported.json(), timeout=60).raise_for_status()
+                        moving.append((source, game_id))
+            except (requests.RequestException, ValueError, KeyError):
+                logger.exception('Moving games to the new shard failed, not adding it',
+                                 extra={'shard': shard.shard_id, 'copiedGames': len(moving)})
+                # Release the copies' images before the worker goes away (matters for S3)
+                for _, game_id in moving:
+                    try:
+                        self.session.delete(f'{shard.url}/api/internal/games/{game_id}', timeout=30)
+                    except requests.RequestException:
+                        pass
+                shard.stop()
+                raise
+
+            self.shards[shard.shard_id] = shard
+            self.ring = ring
+            for source, game_id in moving:
+                try:
+                    self.session.delete(f'{source.url}/api/internal/games/{game_id}', timeout=30).raise_for_status()
+                except requests.RequestException:
+                    # The game is already served by the new shard, the stale copy only costs space
+                    logger.warning('Could not drop moved game from its old shard',
+                                   extra={'shard': source.shard_id, 'gameId': game_id})
+            logger.info('Shard added', extra={'shard': shard.shard_id, 'movedGames': len(moving)})
+        finally:
+            self._release_write()
+        self.refresh_loads(force=True)
+        return shard, len(moving)
+
+    # Proxying
+
+    def forward(self, shard, path, extra_headers=None):
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+        headers.update(extra_headers or {})
+        upstream = self.session.request(
+            request.method,
+            f'{shard.url}{path}',
+            params=request.args,
+            headers=headers,
+            data=_SizedStream(request.stream, request.content_length) if request.content_length else None,
+            stream=True,
+            allow_redirects=False,
+            timeout=(5, None)
+        )
+        response_headers = [(k, v) for k, v in upstream.raw.headers.items() if k.lower() not in HOP_HEADERS]
+        return Response(upstream.raw.stream(64 * 1024, decode_content=False),
+                        status=upstream.status_code, headers=response_headers)
+
+    def fan_out(self, path, params=None):
+        """GET path from every shard, returns ({shard_id: json}, [ids of shards that didn't answer])"""
+        results = {}
+        failed = []
+        for shard in list(self.shards.values()):
+            try:
+                response = self.session.get(f'{shard.url}{path}', params=params, timeout=10)
+                response.raise_for_status()
+                results[shard.shard_id] = response.json()
+            except (requests.RequestException, ValueError):
+                logger.warning('Shard did not answer', extra={'shard': shard.shard_id, 'path': path})
+                failed.append(shard.shard_id)
+        return results, failed
+
+
+def create_dispatcher_app(dispatcher, admin_token=None, profiling_token=None):
+    app = Flask(__name__)
+    CORS(app)
+
+    def routed(fn):
+        """Hold the routing lock for the whole request so games can't move underneath it"""
+        def wrapper(*args, **kwargs):
+            dispatcher._acquire_read()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                dispatcher._release_read()
+        wrapper.__name__ = fn.__name__
+        return wrapper
+
+    @app.route('/api/game/create', methods=['POST'])
+    @routed
+    def create_game():
+        shard, game_id = dispatcher.assign_game_id()
+        return dispatcher.forward(shard, request.path, {'X-Assigned-Game-Id': game_id})
+
+    @app.route('/api/game/<game_id>/<path:rest>', methods=['GET', 'POST'])
+    def game_route(game_id, rest):
+        if rest == 'status' and 'waitForVersion' in request.args:
+            # A long-poll can wait up to a minute, so it must not hold the routing
+            # lock and stall a rebalance (and every request queued behind it).
+            # If the game moves meanwhile the old shard answers 404 when it drops
+            # it; ask the new owner once the rebalance is done.
+            response = dispatcher.forward(dispatcher.shard_for(game_id), request.path)
+            if response.status_code != 404:
+                return response
+            response.close()
+        return routed(lambda: dispatcher.forward(dispatcher.shard_for(game_id), request.path))()
+
+    @app.route('/api/leaderboard', methods=['GET'])
+    @routed
+    def get_leaderboard():
+        limit = request.args.get('limit', 10, type=int)
+        if not 1 <= limit <= 1000:
+            return jsonify({'error': 'limit must be between 1 and 1000'}), 400
+
+        per_shard, failed = dispatcher.fan_out('/api/leaderboard', {'limit': limit})
+        entries = sorted((entry for board in per_shard.values() for entry in board['entries']),
+                         key=lambda entry: -entry['final_score'])[:limit]
+        # Each shard's top-K holds every entry that can make the merged top-K,
+        # so ranks can be recomputed from the merged list (ties share a rank)
+        for i, entry in enumerate(entries):
+            if i and entry['final_score'] == entries[i - 1]['final_score']:
+                entry['rank'] = entries[i - 1]['rank']
+            else:
+                entry['rank'] = i + 1
+        return jsonify({
+            'totalGames': sum(board['totalGames'] for board in per_shard.values()),
+            'entries': entries,
+            # Games on these shards are missing from the merged board
+            'unavailableShards': failed
+        })
+
+    @app.route('/api/game/<game_id>/percentile', methods=['GET'])
+    @routed
+    def get_game_percentile(game_id):
+        try:
+            owner = dispatcher.session.get(f'{dispatcher.shard_for(game_id).url}/api/game/{game_id}/percentile', timeout=10)
+        except requests.RequestException:
+            return jsonify({'error': 'The shard holding this game is unavailable'}), 502
+        if not owner.ok:
+            return Response(owner.content, status=owner.status_code, content_type=owner.headers.get('Content-Type'))
+
+        result = owner.json()
+        per_shard, failed = dispatcher.fan_out('/api/leaderboard/counts', {'score': result['final_score']})
+        counts = per_shard.values()
+        total = sum(c['total'] for c in counts)
+        below = sum(c['below'] for c in counts)
+        at_or_below = sum(c['atOrBelow'] for c in counts)
+        if total:
+            result.update({
+                'rank': total - at_or_below + 1,
+                'totalGames': total,
+                'percentile': round(100.0 * (below + 0.5 * (at_or_below - below)) / total, 2)
+            })
+        # Otherwise the owner's own rank is the best available answer
+        result['unavailableShards'] = failed
+        return jsonify(result)
+
+    @app.route('/api/leaderboard/counts', methods=['GET'])
+    @routed
+    def get_leaderboard_counts():
+        per_shard, failed = dispatcher.fan_out('/api/leaderboard/counts', request.args)
+        merged = {key: sum(c[key] for c in per_shard.values()) for key in ('below', 'atOrBelow', 'total')}
+        return jsonify(dict(merged, unavailableShards=failed))
+
+    @app.route('/api/generation/stats', methods=['GET'])
+    def generation_stats():
+        # Every worker runs its own scheduler, report each one and the deployment-wide totals
+        per_shard, failed = dispatcher.fan_out('/api/generation/stats')
+        totals = {key: sum(stats[key] for stats in per_shard.values()) for key in ('active', 'waiting', 'maxConcurrent', 'maxQueue')}
+        return jsonify(dict(totals, shards=per_shard, unavailableShards=failed))
+
+    @app.route('/api/upstreams', methods=['GET'])
+    def upstream_status():
+        # Breakers are per worker too: one snapshot per shard and upstream
+        per_shard, failed = dispatcher.fan_out('/api/upstreams')
+        upstreams = {
+            name: {shard_id: snapshots[name] for shard_id, snapshots in per_shard.items()}
+            for name in ('openai', 'replicate')
+        }
+        return jsonify(dict(upstreams, unavailableShards=failed))
+
+    @app.route('/api/search/similar', methods=['GET'])
+    @routed
+    def search_similar_games():
+        # Vector indexes are per shard, so this only finds matches among games on the same shard
+        game_id = request.args.get('gameId')
+        if not game_id:
+            return jsonify({'error': 'gameId is required'}), 400
+        return dispatcher.forward(dispatcher.shard_for(game_id), request.path)
+
+    def admin_allowed():
+        # Shard management is off unless a token is configured; workers' /api/internal routes are never proxied
+        supplied = request.headers.get('X-Admin-Token', '')
+        return bool(admin_token) and hmac.compare_digest(supplied.encode('utf-8'), admin_token.encode('utf-8'))
+
+    @app.route('/api/shards', methods=['GET'])
+    def list_shards():
+        if not admin_allowed():
+            return jsonify({'error': 'Not found'}), 404
+        dispatcher.refresh_loads(force=True)
+        return jsonify({'shards': [
+            {'shardId': s.shard_id, 'url': s.url, 'activeGames': s.active_games}
+            for s in dispatcher.shards.values()
+        ]})
+
+    @app.route('/api/shards', methods=['POST'])
+    def add_shard():
+        if not admin_allowed():
+            return jsonify({'error': 'Not found'}), 404
+        try:
+            shard, moved = dispatcher.add_shard()
+        except (requests.RequestException, ValueError, KeyError, RuntimeError) as e:
+            return jsonify({'error': f'Could not add a shard: {e}'}), 502
+        return jsonify({'shardId': shard.shard_id, 'url': shard.url, 'movedGames': moved})
+
+    @app.route('/api/debug/profile', methods=['GET'])
+    def capture_profile():
+        # Workers only listen on 127.0.0.1, so ?shard=<id> is the way to profile one other than the first.
+        # A capture can run for a minute and shards never go away, so this doesn't hold the routing lock.
+        shard_id = request.args.get('shard', 0, type=int)
+        extra_headers = {}
+        if 'shard' in request.args:
+            if admin_allowed() and profiling_token:
+                # The worker still checks the profiling token, vouch for the admin
+                extra_headers['X-Profile-Token'] = profiling_token
+            elif not check_profiling_token(request, profiling_token):
+                return jsonify({'error': 'Not found'}), 404
+        shard = dispatcher.shards.get(shard_id)
+        if shard is None:
+            return jsonify({'error': f'Unknown shard: {shard_id}'}), 404
+        return dispatcher.forward(shard, request.path, extra_headers)
+
+    # Only these worker-local routes are proxied (to the first shard); anything
+    # else, in particular the workers' /api/internal routes, is a 404 here
+    @app.route('/api/health', methods=['GET'], endpoint='health_check')
+    @app.route('/api/test-openai', methods=['GET'], endpoint='test_openai')
+    @app.route('/api/test-ml-models', methods=['GET'], endpoint='test_ml_models')
+    @routed
+    def shard_local_route():
+        return dispatcher.forward(dispatcher.shards[0], request.path)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run app.py as N sharded workers behind one dispatcher')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SHARD_WORKERS', 2)))
+    parser.add_argument('--host', default=os.getenv('FLASK_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('FLASK_PORT', 5000)))
+    parser.add_argument('--worker-base-port', type=int, default=int(os.getenv('SHARD_BASE_PORT', 5001)))
+    parser.add_argument('--data-root', default=os.getenv('SHARD_DATA_ROOT', 'shards'))
+    args = parser.parse_args()
+
+    setup_logging(getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO))
+    dispatcher = ShardDispatcher(base_port=args.worker_base_port, data_root=args.data_root)
+    try:
+        dispatcher.start(args.workers)
+        app = create_dispatcher_app(dispatcher, os.getenv('SHARD_ADMIN_TOKEN'), os.getenv('PROFILING_TOKEN'))
+        app.run(host=args.host, port=args.port, threaded=True)
+    finally:
+        dispatcher.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Correlation ids of the request being handled on the current thread
+request_id_var = contextvars.ContextVar('request_id', default=None)
+game_id_var = contextvars.ContextVar('game_id', default=None)
+
+# Standard LogRecord attributes, everything else passed via extra= is emitted as a field
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'requestId', 'gameId'}
+
+
+class ContextFilter(logging.Filter):
+    """Stamp records with the current request and game ids"""
+
+    def filter(self, record):
+        record.requestId = request_id_var.get()
+        record.gameId = getattr(record, 'gameId', None) or game_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of records at noisy levels, e.g. {logging.DEBUG: 0.1}.
+    Levels without a rate are always kept.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'requestId': getattr(record, 'requestId', None),
+            'gameId': getattr(record, 'gameId', None)
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to the writer thread. Only the message and any traceback are
+    rendered on the calling thread, the JSON encoding and the write happen in
+    the background.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+
+
+def setup_logging(level=logging.INFO, sample_rates=None, stream=None):
+    """
+    Route all logging through a queue to a background thread that writes JSON
+    lines. Returns the QueueListener (already started).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(ContextFilter())
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output)
+    _listener.start()
+    # Flush whatever is still queued on shutdown
+    atexit.register(_listener.stop)
+    return _listener
+
+
+def init_request_context(app):
+    """Assign request/game correlation ids and log one line per request with its duration"""
+    from flask import g, request
+
+    access_log = logging.getLogger('app.request')
+
+    @app.before_request
+    def bind_request_ids():
+        g.request_started = time.perf_counter()
+        request_id_var.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+        game_id_var.set((request.view_args or {}).get('game_id'))
+
+    @app.after_request
+    def log_request(response):
+        response.headers['X-Request-ID'] = request_id_var.get() or ''
+        access_log.info('request', extra={
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'durationMs': round((time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000, 2)
+        })
+        return response
+
+    @app.teardown_request
+    def clear_request_ids(error=None):
+        # Threads are reused by most servers, don't let ids leak into the next request
+        request_id_var.set(None)
+        game_id_var.set(None)
+
+
+@contextmanager
+def log_stage(logger, stage, **fields):
+    """Log how long a stage of request handling took"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        logger.info('stage', extra=dict(fields, stage=stage, durationMs=round((time.perf_counter() - started) * 1000, 2)))
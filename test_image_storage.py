@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from image_storage import ImageStore, InMemoryS3Client, S3Backend, shard_path
+
+
+class S3ImageStoreTest(unittest.TestCase):
+    """ImageStore on the S3 backend, against the in-memory S3 stand-in"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.client = InMemoryS3Client()
+        self.backend = S3Backend(self.client, 'images', os.path.join(self.root, 'cache'), prefix='test/')
+        self.store = ImageStore(self.backend, os.path.join(self.root, 'tmp'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def object_keys(self):
+        return sorted(key for _, key in self.client.objects)
+
+    def test_put_uploads_one_object_per_content(self):
+        key = self.store.put_bytes(b'image bytes')
+        self.assertEqual(self.object_keys(), [f'test/{key[:2]}/{key[2:4]}/{key}'])
+        self.assertEqual(self.client.objects[('images', self.object_keys()[0])], b'image bytes')
+        # Temp files are consumed, nothing is left behind
+        self.assertEqual(os.listdir(self.store.temp_dir), [])
+
+    def test_identical_content_is_stored_once(self):
+        first = self.store.put_bytes(b'same')
+        second = self.store.put_bytes(b'same')
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.client.objects), 1)
+        self.assertEqual(os.listdir(self.store.temp_dir), [])
+
+    def test_object_is_deleted_with_the_last_reference(self):
+        key = self.store.put_bytes(b'shared')
+        self.store.put_bytes(b'shared')
+
+        self.store.release(key)
+        self.assertEqual(len(self.client.objects), 1)
+        self.store.release(key)
+        self.assertEqual(self.client.objects, {})
+        self.assertFalse(os.path.exists(shard_path(self.backend.cache_root, key)))
+
+    def test_local_path_downloads_into_the_cache(self):
+        key = self.store.put_bytes(b'cached bytes')
+        path = self.store.local_path(key)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'cached bytes')
+
+        # A cold cache (another process, or after a restart) fetches the object
+        os.remove(path)
+        path = self.store.local_path(key)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'cached bytes')
+
+    def test_serve_returns_a_presigned_url(self):
+        key = self.store.put_bytes(b'served')
+        kind, url = self.store.serve(key)
+        self.assertEqual(kind, 'url')
+        self.assertIn(f'test/{key[:2]}/{key[2:4]}/{key}', url)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Formats PIL may report for an upload, matching ALLOWED_EXTENSIONS
+ALLOWED_FORMATS = {'PNG', 'JPEG', 'GIF'}
+
+
+class HashingSpool:
+    """
+    Temp file that uploads are streamed into chunk by chunk.
+
+    The SHA-256 is computed as the bytes arrive and the upload is aborted with a
+    413 as soon as it passes ``max_bytes``, so oversized files are never fully
+    written. The spool is created next to the image store so a finished upload
+    can be moved into place with a rename instead of another copy.
+    """
+
+    def __init__(self, temp_dir, max_bytes):
+        fd, self.name = tempfile.mkstemp(dir=temp_dir, suffix='.upload')
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._claimed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge(f'Upload exceeds the {self.max_bytes} byte limit')
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def claim(self):
+        """Close the spool and hand its temp file over to the caller"""
+        self._claimed = True
+        self._file.close()
+        return self.name
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self._claimed and os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __getattr__(self, name):
+        # read, readline, seek, tell, flush... go to the underlying file
+        return getattr(self._file, name)
+
+
+class StreamingRequest(Request):
+    """Request that spools file uploads through a HashingSpool"""
+
+    @property
+    def max_content_length(self):
+        # Whole games moved between shard workers (base64 images and all) are not uploads
+        if current_app.config.get('UNLIMITED_INTERNAL_BODIES') and self.path.startswith('/api/internal/'):
+            return None
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpool(current_app.config['UPLOAD_TEMP_DIR'], current_app.config.get('MAX_CONTENT_LENGTH'))
+
+
+def inspect_image(path, max_pixels):
+    """
+    Check an upload is a real image of a sane size without decoding it.
+
+    Image.open only parses the header, so this is cheap even for large files.
+    Returns (size, None) on success or (None, error message).
+    """
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            width, height = image.size
+    except Exception:
+        return None, 'File is not a valid image'
+
+    if image_format not in ALLOWED_FORMATS:
+        return None, f'Unsupported image format: {image_format}'
+    if width * height > max_pixels:
+        return None, f'Image is too large ({width}x{height}), the limit is {max_pixels} pixels'
+    return (width, height), None
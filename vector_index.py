@@ -0,0 +1,303 @@
+import json
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+# Rows are written to a memory-mapped float32 file that grows in chunks of this many rows
+GROW_ROWS = 65536
+# Flat scans are done in blocks to bound the size of the temporary score array
+SCAN_ROWS = 65536
+# Below this many vectors a flat scan is already only a few milliseconds
+IVF_MIN_ROWS = 50000
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 40
+# Bounds on the partition so training stays a few hundred MB at most even at millions of rows
+MAX_LISTS = 1024
+MAX_KMEANS_SAMPLES = 65536
+# Rows per block when assigning vectors to centroids, bounds the rows x lists score matrix
+ASSIGN_ROWS = 8192
+
+
+def _nearest_centroids(vectors, centroids, begin, end):
+    """Index of the closest centroid for rows begin..end, computed block by block"""
+    nearest = np.empty(end - begin, dtype=np.int64)
+    for start in range(begin, end, ASSIGN_ROWS):
+        stop = min(start + ASSIGN_ROWS, end)
+        nearest[start - begin:stop - begin] = np.argmax(vectors[start:stop] @ centroids.T, axis=1)
+    return nearest
+
+
+def _build_lists(nearest, nlist):
+    """Row ids grouped by centroid; rows assigned -1 (tombstoned) are left out"""
+    order = np.argsort(nearest, kind='stable')
+    bounds = np.searchsorted(nearest[order], np.arange(nlist + 1))
+    return [order[bounds[c]:bounds[c + 1]].tolist() for c in range(nlist)]
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class VectorIndex:
+    """
+    Persistent cosine-similarity index over fixed-size embeddings.
+
+    Vectors are L2-normalized and appended to ``<path>.f32`` (memory-mapped),
+    and one JSON line per row is appended to ``<path>.jsonl`` with the game id
+    and position the vector came from. Searches scan every row until the index
+    holds IVF_MIN_ROWS vectors; past that an inverted-file partition (k-means
+    centroids, ~4*sqrt(n) lists) is built in a background thread and searches
+    only visit the ``nprobe`` closest lists. The partition is rebuilt whenever
+    the index doubles in size and is saved next to the index, so a restart
+    doesn't fall back to flat scans: ``<path>.ivf.npz`` holds the centroids and
+    ``<path>.ivf-<rows>.i32`` the list of every row, appended as rows are added.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self._vectors_path = path + '.f32'
+        self._meta_path = path + '.jsonl'
+        self._partition_path = path + '.ivf.npz'
+        self._lists_path = None
+        self._lock = threading.Lock()
+
+        self._meta = []
+        self._rows_by_game = defaultdict(list)
+        self._removed = set()
+        self._load_meta()
+        # False for tombstoned rows, so searches can mask them instead of over-fetching
+        self._live = np.ones(0, dtype=bool)
+
+        capacity = 0
+        if os.path.exists(self._vectors_path):
+            capacity = os.path.getsize(self._vectors_path) // (4 * dim)
+        self._vectors = None
+        self._capacity = 0
+        self._ensure_capacity(max(capacity, len(self._meta)))
+
+        self._centroids = None
+        self._lists = None
+        self._trained_rows = 0
+        # Index size when the current partition was built, to retrain once it doubles
+        self._partition_size = 0
+        self._training = False
+        self._load_partition()
+        self._maybe_train()
+
+    def _load_meta(self):
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if 'removed' in record:
+                    for row in self._rows_by_game.pop(record['removed'], []):
+                        self._removed.add(row)
+                    continue
+                self._rows_by_game[record['gameId']].append(len(self._meta))
+                self._meta.append((record['gameId'], record['position']))
+
+    def _load_partition(self):
+        if not os.path.exists(self._partition_path):
+            return
+        try:
+            with np.load(self._partition_path) as saved:
+                centroids = saved['centroids']
+                partition_size = int(saved['partition_size'])
+            lists_path = f'{self.path}.ivf-{partition_size}.i32'
+            nearest = np.fromfile(lists_path, dtype=np.int32)
+        except (OSError, ValueError, KeyError):
+            # A partition that can't be read is rebuilt like a missing one
+            return
+        count = len(self._meta)
+        if centroids.shape[1] != self.dim or len(nearest) > count:
+            return
+
+        nearest = nearest.astype(np.int64)
+        nearest[~self._live[:len(nearest)]] = -1
+        self._centroids = centroids
+        self._lists = _build_lists(nearest, len(centroids))
+        self._lists_path = lists_path
+        self._partition_size = partition_size
+        self._trained_rows = len(nearest)
+        # Rows whose list wasn't written before the process stopped
+        self._assign_locked(len(nearest), count)
+
+    def _ensure_capacity(self, rows):
+        if rows <= self._capacity and self._vectors is not None:
+            return
+        capacity = max(rows, self._capacity)
+        capacity = ((capacity + GROW_ROWS - 1) // GROW_ROWS) * GROW_ROWS or GROW_ROWS
+        if self._vectors is not None:
+            self._vectors.flush()
+        with open(self._vectors_path, 'ab') as f:
+            f.truncate(capacity * 4 * self.dim)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        live = np.ones(capacity, dtype=bool)
+        live[:len(self._live)] = self._live
+        if not len(self._live) and self._removed:
+            live[list(self._removed)] = False
+        self._live = live
+        self._capacity = capacity
+
+    def __len__(self):
+        return len(self._meta) - len(self._removed)
+
+    def has(self, game_id):
+        return game_id in self._rows_by_game
+
+    def add(self, game_id, vectors):
+        """Append one vector per position for a game"""
+        vectors = _normalize(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+
+        with self._lock:
+            start = len(self._meta)
+            self._ensure_capacity(start + len(vectors))
+            self._vectors[start:start + len(vectors)] = vectors
+
+            with open(self._meta_path, 'a') as f:
+                for position in range(len(vectors)):
+                    f.write(json.dumps({'gameId': game_id, 'position': position}) + '\n')
+                    self._rows_by_game[game_id].append(start + position)
+                    self._meta.append((game_id, position))
+
+            if self._centroids is not None:
+                self._assign_locked(start, start + len(vectors))
+
+        self._maybe_train()
+
+    def remove(self, game_id):
+        """Drop a game's vectors from future results (rows stay on disk as tombstones)"""
+        with self._lock:
+            rows = self._rows_by_game.pop(game_id, None)
+            if not rows:
+                return False
+            self._removed.update(rows)
+            self._live[rows] = False
+            with open(self._meta_path, 'a') as f:
+                f.write(json.dumps({'removed': game_id}) + '\n')
+            return True
+
+    def vectors_for(self, game_id):
+        """Return [(position, vector)] for a game"""
+        with self._lock:
+            return [(self._meta[row][1], np.array(self._vectors[row])) for row in self._rows_by_game.get(game_id, [])]
+
+    def search(self, query, k=10, nprobe=8, exclude_game=None):
+        """Return up to k (gameId, position, cosine) tuples, best first"""
+        query = _normalize(query)[0]
+
+        with self._lock:
+            count = len(self._meta)
+            centroids = self._centroids
+            lists = self._lists
+            live = self._live[:count].copy()
+            # Removed and excluded rows are masked out, so the top-k never has to grow past k
+            live[self._rows_by_game.get(exclude_game, [])] = False
+
+            if centroids is not None:
+                closest = np.argsort(-(centroids @ query))[:nprobe]
+                candidates = np.concatenate([np.asarray(lists[c], dtype=np.int64) for c in closest] + [np.arange(self._trained_rows, count)])
+                candidates = candidates[live[candidates]]
+                candidates.sort()
+                scores = self._vectors[candidates] @ query
+                rows = candidates
+            else:
+                scores = np.empty(count, dtype=np.float32)
+                for begin in range(0, count, SCAN_ROWS):
+                    end = min(begin + SCAN_ROWS, count)
+                    scores[begin:end] = self._vectors[begin:end] @ query
+                scores[~live] = -np.inf
+                rows = np.arange(count)
+
+            fetch = min(k, int(np.count_nonzero(scores > -np.inf)))
+            if fetch == 0:
+                return []
+            top = np.argpartition(-scores, fetch - 1)[:fetch]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for i in top:
+                game_id, position = self._meta[int(rows[i])]
+                results.append((game_id, position, float(scores[i])))
+            return results
+
+    def _assign_locked(self, begin, end):
+        nearest = _nearest_centroids(self._vectors, self._centroids, begin, end)
+        for offset, c in enumerate(nearest):
+            self._lists[c].append(begin + offset)
+        self._trained_rows = end
+        with open(self._lists_path, 'ab') as f:
+            f.write(nearest.astype(np.int32).tobytes())
+
+    def _maybe_train(self):
+        with self._lock:
+            count = len(self._meta)
+            if self._training or count < IVF_MIN_ROWS or count < 2 * self._partition_size:
+                return
+            self._training = True
+        threading.Thread(target=self._train, args=(count,), daemon=True).start()
+
+    def _train(self, count):
+        try:
+            nlist = min(MAX_LISTS, int(4 * np.sqrt(count)))
+            rng = np.random.default_rng(0)
+            with self._lock:
+                live_rows = np.flatnonzero(self._live[:count])
+            size = min(len(live_rows), nlist * KMEANS_SAMPLES_PER_LIST, MAX_KMEANS_SAMPLES)
+            sample = np.sort(rng.choice(live_rows, size=size, replace=False))
+            # The memmap is only ever grown, so this reference stays valid for the first `count` rows
+            vectors = self._vectors
+            data = np.array(vectors[sample])
+
+            # Spherical k-means: centroids are re-normalized means of their members
+            centroids = data[rng.choice(len(data), size=nlist, replace=False)]
+            for _ in range(KMEANS_ITERATIONS):
+                nearest = _nearest_centroids(data, centroids, 0, len(data))
+                # Sum members per centroid with one sort + reduceat instead of a scattered np.add.at
+                order = np.argsort(nearest, kind='stable')
+                counts = np.bincount(nearest, minlength=nlist)
+                starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+                filled = counts > 0
+                sums = centroids.copy()
+                sums[filled] = np.add.reduceat(data[order], starts[filled], axis=0)
+                centroids = _normalize(sums)
+
+            # Tombstoned rows are left out of the lists, so a retrain compacts them away
+            nearest = _nearest_centroids(vectors, centroids, 0, count)
+            nearest[~self._live[:count]] = -1
+            lists = _build_lists(nearest, nlist)
+
+            # The lists file is named after the partition, so the .npz swap below is
+            # the single point where a restart switches to the new partition
+            lists_path = f'{self.path}.ivf-{count}.i32'
+            nearest.astype(np.int32).tofile(lists_path)
+            temp_path = self._partition_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                np.savez(f, centroids=centroids, partition_size=count)
+
+            with self._lock:
+                os.replace(temp_path, self._partition_path)
+                old_lists_path = self._lists_path
+                self._lists_path = lists_path
+                self._centroids = centroids
+                self._lists = lists
+                self._trained_rows = count
+                self._partition_size = count
+                # Rows added while training still need a list
+                self._assign_locked(count, len(self._meta))
+            if old_lists_path is not None and old_lists_path != lists_path:
+                os.remove(old_lists_path)
+        finally:
+            with self._lock:
+                self._training = False